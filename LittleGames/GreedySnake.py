@@ -2,30 +2,27 @@
 
 import pygame
 
-import enum
-import random
+import argparse
+import os
 import sys
-from collections import deque
+import time
+
+import SnakeCore
+from SnakeCore import ROWS, COLUMNS, Autopilot, Direction, GameState, SnakeArena, SnakeGame, has_cycle
 
 FPS = 100
-ROWS = 35
-COLUMNS = 40
 CELL_SIZE = 12
 BACKGROUND_COLOR = (229, 229, 229)
 SCREEN_HEIGHT = ROWS * CELL_SIZE
 SCREEN_WIDTH = COLUMNS * CELL_SIZE
-
-
-@enum.unique
-class Direction(enum.IntEnum):
-    UP = -1
-    DOWN = 1
-    LEFT = -2
-    RIGHT = 2
-
-
-def is_opposite_direction(d1, d2):
-    return d1 + d2 == 0
+# Bigger boards are shown through a view of at most this many cells, which
+# follows the head.
+VIEW_COLUMNS = 80
+VIEW_ROWS = 60
+VIEW_MARGIN = 8
+# body colors of the snakes of an arena
+ARENA_COLORS = ((51, 51, 51), (40, 90, 170), (30, 130, 60),
+                (150, 60, 150), (190, 110, 20), (20, 140, 140))
 
 
 Gkey_to_direction = {
@@ -36,27 +33,31 @@ Gkey_to_direction = {
 }
 
 
+Gwasd_to_direction = {
+    pygame.K_w: Direction.UP,
+    pygame.K_s: Direction.DOWN,
+    pygame.K_a: Direction.LEFT,
+    pygame.K_d: Direction.RIGHT
+}
+
+
 def get_direction(key):
     return Gkey_to_direction.get(key, None)
 
 
-class Snake(object):
+# The rules of SnakeCore.Snake, plus drawing.
+class Snake(SnakeCore.Snake):
 
     HEAD_COLOR = (102, 102, 102)
     BODY_COLOR = (51, 51, 51)
     UPDATE_RATE = 90   # milliseconds
-    GROWING_STEPS = 4
 
-    def __init__(self, cols, rows, back_color, cell_size):
-        self.cols, self.rows = cols, rows
+    def __init__(self, cols, rows, back_color, cell_size,
+                 grid=None, number=0, col=None, body_color=BODY_COLOR):
+        SnakeCore.Snake.__init__(self, cols, rows, grid, number, col)
         self.back_color = back_color
-        self.head = [cols//2, rows-2]
-        self.body = deque([[cols//2, rows-1]])
         self.cell_size = cell_size
-        self.direction = Direction.UP
-        self.growing = False
-        self.turning = False
-        self.growing_steps = Snake.GROWING_STEPS
+        self.body_color = body_color
 
         cell_rect = (0, 0, self.cell_size, self.cell_size)
         self.head_cell = pygame.Surface((self.cell_size, self.cell_size))
@@ -64,86 +65,73 @@ class Snake(object):
         pygame.draw.rect(self.head_cell, Snake.HEAD_COLOR, cell_rect, 1)
 
         self.body_cell = pygame.Surface((self.cell_size, self.cell_size))
-        pygame.draw.rect(self.body_cell, Snake.BODY_COLOR, cell_rect)
+        pygame.draw.rect(self.body_cell, body_color, cell_rect)
         pygame.draw.rect(self.body_cell, back_color, cell_rect, 1)
 
     def init(self):
-        self.__init__(self.cols, self.rows, self.back_color, self.cell_size)
-
-    def get_head(self):
-        return self.head
-
-    def get_body(self):
-        return self.body
+        self.remove()
+        self.__init__(self.cols, self.rows, self.back_color, self.cell_size,
+                      self.grid, self.number, self.col, self.body_color)
 
     def get_head_pos(self):
         col, row = self.head
         return (col*self.cell_size, row*self.cell_size)
 
-    def turn(self, direction):
-        if not isinstance(direction, Direction):
-            raise TypeError("Invalid direction")
-        if not is_opposite_direction(self.direction, direction) and not self.turning:
-            self.direction = direction
-            self.turning = True
-
-    def grow(self):
-        self.growing = True
-        self.growing_steps = Snake.GROWING_STEPS
-
-    def go_ahead(self):
-        self.body.appendleft(self.head[:])
-        if self.direction == Direction.UP:
-            self.head[1] -= 1
-        elif self.direction == Direction.DOWN:
-            self.head[1] += 1
-        elif self.direction == Direction.LEFT:
-            self.head[0] -= 1
-        elif self.direction == Direction.RIGHT:
-            self.head[0] += 1
-        if self.turning:
-            self.turning = False
-
-    def run(self):
-        self.go_ahead()
-        if self.growing:
-            self.growing_steps -= 1
-            self.growing = not (self.growing_steps == 0)
-        else:
-            self.body.pop()
-
     def draw(self, surface):
         surface.blit(self.head_cell, self.get_head_pos())
         for col, row in self.body:
             surface.blit(self.body_cell, (col*self.cell_size, row*self.cell_size))
 
+    def draw_cell(self, surface, col, row, pos):
+        # Draws the part of the snake on one cell at pos, as draw() does.
+        if self.head[0] == col and self.head[1] == row:
+            surface.blit(self.head_cell, pos)
+        if (col, row) in self.body:
+            surface.blit(self.body_cell, pos)
 
-def get_apple():
-    col = random.randint(0, COLUMNS-1)
-    row = random.randint(0, ROWS-1)
-    return pygame.Rect(col*CELL_SIZE, row*CELL_SIZE, CELL_SIZE-1, CELL_SIZE-1)
-
-
-class GameState(enum.Enum):
-    PLAYING = 0
-    PAUSE = 1
-    WIN = 2
-    FAIL = 3
 
+def get_apple(col, row):
+    return pygame.Rect(col*CELL_SIZE, row*CELL_SIZE, CELL_SIZE-1, CELL_SIZE-1)
 
-class Game(object):
 
-    def __init__(self):
+# The first cell in view along one axis of the board, given the position
+# of the head and the first cell in view so far.
+def follow(pos, start, view_size, board_size):
+    if start + VIEW_MARGIN <= pos < start + view_size - VIEW_MARGIN:
+        return start
+    return min(max(pos - view_size//2, 0), board_size - view_size)
+
+
+# Plays a SnakeGame with pygame: the snake is steered with the arrow keys,
+# or by an Autopilot toggled with A. The game runs on a clock of its own,
+# one step of the snake every Snake.UPDATE_RATE, turbo times faster (T
+# cycles through TURBO_FACTORS). An unthrottled game does not wait for the
+# clock at all, it steps once per run(), for running games headless.
+#
+# Boards bigger than VIEW_COLUMNS*VIEW_ROWS are shown through a camera
+# following the head. start_length gives the snake that many cells of body
+# from the start, laid along the cycle of the Autopilot.
+class Game(SnakeGame):
+
+    TURBO_FACTORS = (1, 2, 4, 8, 16)
+    MAX_CATCH_UP = 8    # steps run at most in one frame, to catch up a lag
+
+    def __init__(self, cols=COLUMNS, rows=ROWS, throttled=True, start_length=1):
+        self.view_cols = min(cols, VIEW_COLUMNS)
+        self.view_rows = min(rows, VIEW_ROWS)
+        self.camera = (0, 0)    # the col and row of the top left cell in view
         pygame.display.init()
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        self.screen = pygame.display.set_mode(
+            (self.view_cols*CELL_SIZE, self.view_rows*CELL_SIZE))
         self.clock = pygame.time.Clock()
-        self.user_event_id = pygame.USEREVENT + 1
+        self.throttled = throttled
+        self.turbo = 1
+        self.lag = 0.0      # milliseconds of game time not stepped yet
 
         self.event_handlers = {}
         self.key_handlers = {}
         self.add_handler(pygame.QUIT, lambda event: sys.exit())
         self.add_handler(pygame.KEYDOWN, self.key_down_handler)
-        self.add_timer_handler(Snake.UPDATE_RATE, self.run_snake)
 
         self.add_key_handler(pygame.K_UP, self.key_direction_handler)
         self.add_key_handler(pygame.K_DOWN, self.key_direction_handler)
@@ -151,23 +139,54 @@ class Game(object):
         self.add_key_handler(pygame.K_RIGHT, self.key_direction_handler)
         self.add_key_handler(pygame.K_p, self.key_p_handler)
         self.add_key_handler(pygame.K_SPACE, self.key_space_handler)
+        self.add_key_handler(pygame.K_a, self.key_a_handler)
+        self.add_key_handler(pygame.K_t, self.key_t_handler)
 
-        self.init()
+        self.autopilot = None   # made when first needed, big boards take a while
+        self.autopilot_on = False
+        self.start_length = start_length
+        SnakeGame.__init__(self, cols, rows)
 
     def init(self):
-        self.state = GameState.PLAYING
-        self.snake = Snake(COLUMNS, ROWS, BACKGROUND_COLOR, CELL_SIZE)
-        self.apple = self.get_apple()
+        SnakeGame.init(self)
+        if self.autopilot is not None:
+            self.autopilot.reset()
         self.total_time_passed = 0.0
-        self.score = 0
+        self.steps = 0
+        # the cells draw() has to draw again, None for the whole screen
+        self.dirty_cells = None
         self.refresh_caption("Greedy Snake Score: {0}".format(self.score))
 
+    def new_snake(self):
+        snake = Snake(self.cols, self.rows, BACKGROUND_COLOR, CELL_SIZE)
+        if self.start_length > 1:
+            self.get_autopilot().lay_snake(snake, self.start_length)
+        return snake
+
+    def get_autopilot(self):
+        if self.autopilot is None:
+            self.autopilot = Autopilot(self.cols, self.rows)
+        return self.autopilot
+
     def refresh_caption(self, caption):
         pygame.display.set_caption(caption)
 
-    def run_snake(self, event):
-        if self.state == GameState.PLAYING:
-            self.snake.run()
+    def step(self, direction=None):
+        if self.state != GameState.PLAYING:
+            return self.state
+        if self.autopilot_on:
+            direction = self.autopilot.get_direction(self.snake, self.apple)
+        # the old head becomes the neck, the tail may leave its cell
+        self.mark_dirty(self.snake.get_head())
+        self.mark_dirty(self.snake.get_tail())
+        SnakeGame.step(self, direction)
+        self.mark_dirty(self.snake.get_head())
+        self.steps += 1
+        return self.state
+
+    def mark_dirty(self, pos):
+        if self.dirty_cells is not None:
+            self.dirty_cells.add(tuple(pos))
 
     def add_handler(self, event_type, handler):
         self.event_handlers[event_type] = handler
@@ -175,19 +194,13 @@ class Game(object):
     def add_key_handler(self, key_value, handler):
         self.key_handlers[key_value] = handler
 
-    def add_timer_handler(self, milliseconds, handler):
-        new_event_id = self.user_event_id
-        self.user_event_id += 1
-        self.add_handler(new_event_id, handler)
-        pygame.time.set_timer(new_event_id, milliseconds)
-
     def key_down_handler(self, event):
         handler = self.key_handlers.get(event.key, None)
         if handler is not None:
             handler(event)
 
     def key_direction_handler(self, event):
-        if self.state == GameState.PLAYING:
+        if self.state == GameState.PLAYING and not self.autopilot_on:
             self.snake.turn(get_direction(event.key))
 
     def key_p_handler(self, event):
@@ -202,56 +215,280 @@ class Game(object):
         if self.state == GameState.WIN or self.state == GameState.FAIL:
             self.init()
 
-    def get_apple(self):
-        # TODO : refine Game.getapple()
-        if self.is_win():
-            return None
-        while True:
-            apple = get_apple()
-            apple_pos = list(apple.topleft)
-            apple_pos[0] //= CELL_SIZE
-            apple_pos[1] //= CELL_SIZE
-            if apple_pos != self.snake.get_head() and (not apple_pos in self.snake.get_body()):
-                return apple
-
-    def is_win(self):
-        return len(self.snake.get_body()) + 1 == ROWS * COLUMNS
-
-    def is_fail(self):
-        return self.snake.get_head() in self.snake.get_body() or (
-                not 0 <= self.snake.get_head()[0] < COLUMNS) or (
-                not 0 <= self.snake.get_head()[1] < ROWS)
+    def key_a_handler(self, event):
+        self.autopilot_on = not self.autopilot_on
+        if not self.autopilot_on:
+            return
+        if not has_cycle(self.cols, self.rows):
+            self.autopilot_on = False
+            self.refresh_caption("No autopilot on a {0}x{1} board".format(
+                self.cols, self.rows))
+            return
+        self.get_autopilot()
+        # The autopilot only wins with a snake lying along its cycle, a
+        # snake steered by hand starts again.
+        if self.state == GameState.WIN or self.state == GameState.FAIL or (
+                not self.autopilot.is_on_cycle(self.snake)):
+            self.init()
+        else:
+            self.autopilot.reset()
+
+    def key_t_handler(self, event):
+        factors = Game.TURBO_FACTORS
+        self.turbo = factors[(factors.index(self.turbo) + 1) % len(factors)]
+
+    def on_eat(self):
+        if self.apple is not None:
+            self.mark_dirty(self.apple)
+        self.refresh_caption("Greedy Snake Score: {0}".format(self.score))
+
+    def on_win(self):
+        self.refresh_caption("You Win! Totoal time used {0:.3}!".format(self.total_time_passed))
+
+    def on_fail(self):
+        self.refresh_caption("Game Over! Score: {0}!".format(self.score))
 
     def run(self):
-        time_passed = self.clock.tick(FPS) / 1000.
-        self.total_time_passed += time_passed
+        # Handles the events, then runs the steps due by the clock, so that
+        # a key pressed moves the snake at the next step. Returns how many
+        # steps were run.
+        if self.throttled:
+            milliseconds = self.clock.tick(FPS)
+            self.total_time_passed += milliseconds / 1000.
+            self.lag = min(self.lag + milliseconds*self.turbo,
+                           Game.MAX_CATCH_UP*Snake.UPDATE_RATE)
+        else:
+            self.total_time_passed += Snake.UPDATE_RATE / 1000.
+            self.lag = Snake.UPDATE_RATE
         for event in pygame.event.get():
             handler = self.event_handlers.get(event.type, None)
             if handler is not None:
                 handler(event)
-        if self.state == GameState.PLAYING:
-            if self.apple.collidepoint(self.snake.get_head_pos()):
-                self.snake.grow()
-                self.apple = self.get_apple()
-                self.score += 5
-                self.refresh_caption("Greedy Snake Score: {0}".format(self.score))
-            if self.is_win():
-                self.state = GameState.WIN
-                self.refresh_caption("You Win! Totoal time used {0:.3}!".format(self.total_time_passed))
-            elif self.is_fail():
-                self.state = GameState.FAIL
-                self.refresh_caption("Game Over! Score: {0}!".format(self.score))
+        steps = 0
+        while self.state == GameState.PLAYING and self.lag >= Snake.UPDATE_RATE:
+            self.lag -= Snake.UPDATE_RATE
+            self.step()
+            steps += 1
+        if self.state != GameState.PLAYING:
+            self.lag = 0.0
+        return steps
 
     def draw(self):
+        # The screen keeps the last frame, so only the cells that changed
+        # since are drawn and updated, and nothing at all if the snake has
+        # not moved. The whole view is drawn when the camera moves.
+        if self.follow_head() or self.dirty_cells is None:
+            self.draw_view()
+            pygame.display.update()
+        elif self.dirty_cells:
+            pygame.display.update([self.draw_cell(col, row)
+                                   for col, row in self.dirty_cells
+                                   if self.is_in_view(col, row)])
+        self.dirty_cells = set()
+
+    def follow_head(self):
+        # Centers the view on the head, along each axis once the head gets
+        # within VIEW_MARGIN cells of that edge of the view. Returns whether
+        # the view moved.
+        col, row = self.snake.get_head()
+        left, top = self.camera
+        camera = (follow(col, left, self.view_cols, self.cols),
+                  follow(row, top, self.view_rows, self.rows))
+        moved = camera != self.camera
+        self.camera = camera
+        return moved
+
+    def is_in_view(self, col, row):
+        left, top = self.camera
+        return left <= col < left + self.view_cols and top <= row < top + self.view_rows
+
+    def get_snakes(self):
+        # The snakes on the grid of self.snake, by number.
+        return [self.snake]
+
+    def get_apples(self):
+        return [] if self.apple is None else [self.apple]
+
+    def draw_view(self):
+        # Draws every cell in view. The cells of the snakes are found in the
+        # occupancy grid, a row of the view at a time, so that drawing costs
+        # the same however long the snakes are.
         self.screen.fill(BACKGROUND_COLOR)
-        self.snake.draw(self.screen)
-        if self.apple is not None:
-            self.screen.fill((255, 0, 0), self.apple)
-        pygame.display.update()
+        snakes = self.get_snakes()
+        occupancy, owner = self.snake.occupancy, self.snake.owner
+        cols, width = self.cols, self.view_cols
+        left, top = self.camera
+        empty = bytes(width)
+        for row in range(top, top + self.view_rows):
+            start = row*cols + left
+            line = occupancy[start:start + width]
+            if line == empty:
+                continue
+            y = (row - top) * CELL_SIZE
+            for i, count in enumerate(line):
+                if count:
+                    snakes[owner[start + i]].draw_cell(
+                        self.screen, left + i, row, (i*CELL_SIZE, y))
+        for col, row in self.get_apples():
+            if self.is_in_view(col, row):
+                self.screen.fill((255, 0, 0), get_apple(col - left, row - top))
+
+    def draw_cell(self, col, row):
+        # Draws one cell in view as the whole view is drawn. Returns its rect.
+        left, top = self.camera
+        rect = pygame.Rect((col - left)*CELL_SIZE, (row - top)*CELL_SIZE,
+                           CELL_SIZE, CELL_SIZE)
+        self.screen.fill(BACKGROUND_COLOR, rect)
+        cell = row*self.cols + col
+        if self.snake.occupancy[cell]:
+            snake = self.get_snakes()[self.snake.owner[cell]]
+            snake.draw_cell(self.screen, col, row, rect.topleft)
+        if (col, row) in self.get_apples():
+            self.screen.fill((255, 0, 0), get_apple(col - left, row - top))
+        return rect
+
+
+# Several snakes on one board, with the rules of SnakeCore.SnakeArena. The
+# first `humans` snakes are steered with the arrow keys and with WASD, the
+# others steer themselves to the apples. The view follows the first snake.
+class ArenaGame(Game):
+
+    def __init__(self, count=4, humans=1, apple_count=3,
+                 cols=COLUMNS, rows=ROWS, throttled=True):
+        # the arrows steer the first snake and WASD the second one
+        if not 0 <= humans <= min(count, 2):
+            raise ValueError("Invalid number of humans {0}".format(humans))
+        self.count = count
+        self.humans = humans
+        self.apple_count = apple_count
+        Game.__init__(self, cols, rows, throttled)
+        # WASD steers the second snake, there is no autopilot
+        for key in Gwasd_to_direction:
+            self.add_key_handler(key, self.key_wasd_handler)
+
+    def init(self):
+        self.arena = SnakeArena(self.count, self.cols, self.rows,
+                                self.apple_count, self.new_arena_snake)
+        Game.init(self)
+        self.refresh_scores()
+
+    def new_snake(self):
+        return self.arena.snakes[0]
 
+    def new_arena_snake(self, number, grid, col):
+        return Snake(self.cols, self.rows, BACKGROUND_COLOR, CELL_SIZE, grid,
+                     number, col, ARENA_COLORS[number % len(ARENA_COLORS)])
 
-def main():
-    game = Game()
+    def get_apple(self):
+        # the apples are the arena's
+        return None
+
+    def get_snakes(self):
+        return self.arena.snakes
+
+    def get_apples(self):
+        return self.arena.apples
+
+    def step(self, direction=None):
+        arena = self.arena
+        if self.state != GameState.PLAYING:
+            return self.state
+        directions = [None] * self.count
+        moving = [i for i in range(self.count) if arena.alive[i]]
+        for i in moving:
+            if i >= self.humans:
+                directions[i] = arena.steer(i)
+            self.mark_dirty(arena.snakes[i].get_head())
+            self.mark_dirty(arena.snakes[i].get_tail())
+        arena.step(directions)
+        for i in moving:
+            self.mark_dirty(arena.snakes[i].get_head())
+        for apple in arena.new_apples:
+            self.mark_dirty(apple)
+        if arena.dead:
+            # their cells are free now
+            self.dirty_cells = None
+        self.steps += 1
+        if arena.new_apples or arena.dead:
+            self.score = arena.scores[0]
+            self.refresh_scores()
+        if arena.state != GameState.PLAYING:
+            self.state = arena.state
+            if self.state == GameState.WIN:
+                self.on_win()
+            else:
+                self.on_fail()
+        return self.state
+
+    def key_direction_handler(self, event):
+        self.turn_snake(0, get_direction(event.key))
+
+    def key_wasd_handler(self, event):
+        self.turn_snake(1, Gwasd_to_direction[event.key])
+
+    def turn_snake(self, number, direction):
+        if self.state == GameState.PLAYING and number < self.humans:
+            self.arena.snakes[number].turn(direction)
+
+    def refresh_scores(self):
+        self.refresh_caption("Greedy Snake Arena Scores: {0}".format(
+            " ".join(str(score) for score in self.arena.scores)))
+
+    def on_win(self):
+        self.refresh_caption("Snake {0} wins! Scores: {1}".format(
+            self.arena.get_winner(),
+            " ".join(str(score) for score in self.arena.scores)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Greedy Snake")
+    parser.add_argument('--autopilot', action='store_true',
+                        help="let the autopilot play")
+    parser.add_argument('--turbo', type=int, default=1,
+                        choices=Game.TURBO_FACTORS,
+                        help="how many times faster the snake moves")
+    parser.add_argument('--columns', type=int, default=COLUMNS)
+    parser.add_argument('--rows', type=int, default=ROWS)
+    parser.add_argument('--length', type=int, default=1,
+                        help="cells of body the snake starts with")
+    parser.add_argument('--arena', type=int, metavar='SNAKES',
+                        help="play an arena of this many snakes")
+    parser.add_argument('--humans', type=int, default=1,
+                        help="snakes of the arena steered by keys, up to 2")
+    parser.add_argument('--apples', type=int, default=3,
+                        help="apples on the board of the arena at once")
+    parser.add_argument('--headless', action='store_true',
+                        help="play one game as fast as possible, without "
+                             "a window, and print the result")
+    args = parser.parse_args(argv)
+    if args.arena and args.autopilot:
+        parser.error("the autopilot only plays games of one snake")
+    if args.arena and not 0 <= args.humans <= min(args.arena, 2):
+        parser.error("--humans must be from 0 to {0}".format(min(args.arena, 2)))
+    if (args.autopilot or args.length > 1) and not has_cycle(args.columns, args.rows):
+        parser.error("the autopilot and --length need a board with an even "
+                     "number of columns or rows")
+
+    if args.headless:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    if args.arena:
+        game = ArenaGame(args.arena, args.humans, args.apples,
+                         args.columns, args.rows, not args.headless)
+    else:
+        game = Game(args.columns, args.rows, not args.headless, args.length)
+    game.turbo = args.turbo
+    if args.autopilot:
+        game.key_a_handler(None)
+
+    if args.headless:
+        start = time.perf_counter()
+        while game.state == GameState.PLAYING:
+            game.run()
+        seconds = time.perf_counter() - start
+        print("{0}: score {1}, {2} steps in {3:.2f}s, {4:.0f} steps/s".format(
+            game.state.name, game.score, game.steps, seconds,
+            game.steps / seconds))
+        return
     while True:
         game.run()
         game.draw()
@@ -0,0 +1,241 @@
+#! /usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Times the hot operations of GreedySnake with snakes from 10 cells long to
+# the whole board, laid along the cycle of the Autopilot, and reports their
+# latency percentiles and how many steps a second a game runs. Runs without
+# a display, with seeded random. Save a baseline with --save and check a
+# later run against it with --compare:
+#
+#   python SnakeBench.py --save baseline.json
+#   python SnakeBench.py --compare baseline.json
+#
+# Compare runs of the same machine only, when it is otherwise idle: the
+# tolerance is wide because a busy machine alone makes a run half as fast
+# again, while the regressions worth catching, an operation going through
+# the whole snake, are many times slower.
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import GreedySnake
+from SnakeCore import ROWS, COLUMNS, has_cycle
+
+OPERATIONS = ('Snake.run', 'Game.is_fail', 'Game.get_apple', 'Snake.draw')
+STEPS     = 10        # game steps timed per sample of the operations
+TOLERANCE = 0.5       # how much slower than the baseline is a regression
+
+
+def get_lengths(cols, rows):
+    # From 10 cells to the whole board, more of them near the end, where
+    # the free cells run out.
+    cells = cols * rows
+    lengths = {10, 100, cells//4, cells//2, 3*cells//4, cells - 10, cells - 2}
+    return sorted(length for length in lengths if 10 <= length <= cells - 2)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values)-1, int(p / 100.0 * len(values)))]
+
+
+def summarize(rounds):
+    # Latencies in microseconds, of all the rounds of samples. 'best' is the
+    # lowest median of a round, what the comparison with a baseline uses, as
+    # it is the least disturbed by whatever else the machine was doing.
+    micros = [s * 1e6 for seconds in rounds for s in seconds]
+    return {
+        'p50'  : percentile(micros, 50),
+        'p90'  : percentile(micros, 90),
+        'p99'  : percentile(micros, 99),
+        'max'  : max(micros),
+        'mean' : sum(micros) / len(micros),
+        'best' : min(percentile(seconds, 50) for seconds in rounds) * 1e6,
+    }
+
+
+def time_operations(game, samples):
+    # Times each operation samples times, moving the snake along the cycle
+    # of the autopilot so that it neither grows nor dies.
+    autopilot = game.get_autopilot()
+    snake = game.snake
+    times = dict((name, []) for name in OPERATIONS)
+    clock = time.perf_counter
+    for _ in range(samples):
+        head = snake.get_head_cell()
+        snake.turn(autopilot.get_move(head, autopilot.next_cell[head]))
+        start = clock()
+        snake.run()
+        times['Snake.run'].append(clock() - start)
+        start = clock()
+        game.is_fail()
+        times['Game.is_fail'].append(clock() - start)
+        start = clock()
+        game.get_apple()
+        times['Game.get_apple'].append(clock() - start)
+        start = clock()
+        snake.draw(game.screen)
+        times['Snake.draw'].append(clock() - start)
+    return times
+
+
+def time_steps(game, steps):
+    # Runs whole steps of the game, with the autopilot steering, starting
+    # the game again whenever it ends. Returns the seconds they took.
+    game.autopilot_on = True
+    game.init()
+    done, seconds = 0, 0.0
+    while done < steps:
+        start = time.perf_counter()
+        while done < steps and game.state == GreedySnake.GameState.PLAYING:
+            game.step()
+            done += 1
+        seconds += time.perf_counter() - start
+        if game.state != GreedySnake.GameState.PLAYING:
+            game.init()
+    return seconds
+
+
+def run(cols, rows, lengths, samples, rounds, seed):
+    # The rounds go through all the lengths in turn, so that the machine
+    # being slower for a while slows one round of every length rather than
+    # all the rounds of one.
+    game = GreedySnake.Game(cols, rows, throttled=False)
+    times = dict((length, dict((name, []) for name in OPERATIONS))
+                 for length in lengths)
+    step_seconds = dict((length, []) for length in lengths)
+    for i in range(rounds):
+        for length in lengths:
+            random.seed(seed + i)
+            game.start_length = length
+            game.autopilot_on = False
+            game.init()
+            for name, seconds in time_operations(game, samples).items():
+                times[length][name].append(seconds)
+            step_seconds[length].append(time_steps(game, samples * STEPS))
+    results = {}
+    for length in lengths:
+        result = dict((name, summarize(times[length][name]))
+                      for name in OPERATIONS)
+        result['steps_per_second'] = samples * STEPS / min(step_seconds[length])
+        results[str(length)] = result
+    total_steps = samples * STEPS * rounds * len(lengths)
+    total_seconds = sum(sum(seconds) for seconds in step_seconds.values())
+    return {
+        'config' : {
+            'columns' : cols,
+            'rows'    : rows,
+            'lengths' : lengths,
+            'samples' : samples,
+            'rounds'  : rounds,
+            'seed'    : seed,
+        },
+        'lengths' : results,
+        'summary' : {
+            'steps_per_second' : total_steps / total_seconds if total_seconds else 0.0,
+        },
+    }
+
+
+def print_results(results):
+    config = results['config']
+    print("GreedySnake on {0}x{1}, {2} rounds of {3} samples per length, "
+          "latencies in us".format(config['columns'], config['rows'],
+                                   config['rounds'], config['samples']))
+    print("{0:>8} {1:<15} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}".format(
+        'length', 'operation', 'best', 'p50', 'p90', 'p99', 'max'))
+    for length in config['lengths']:
+        result = results['lengths'][str(length)]
+        for name in OPERATIONS:
+            stats = result[name]
+            print("{0:>8} {1:<15} {2:>9.2f} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>9.2f}".format(
+                length, name, stats['best'], stats['p50'], stats['p90'],
+                stats['p99'], stats['max']))
+        print("{0:>8} {1:<15} {2:>9.0f}".format(
+            length, 'steps/s', result['steps_per_second']))
+    print("{0:>12.0f} steps/s in all".format(results['summary']['steps_per_second']))
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # Prints how the best median latencies and the steps per second changed
+    # from baseline, at the lengths both have. Returns the regressions, as
+    # (length, name, ratio) with ratio > 1 + tolerance being that much
+    # slower.
+    if (baseline['config']['columns'], baseline['config']['rows']) != (
+            results['config']['columns'], results['config']['rows']):
+        print("warning: the baseline was run on another board")
+    regressions = []
+    print("{0:>8} {1:<15} {2:>11} {3:>11} {4:>7}".format(
+        'length', 'operation', 'baseline', 'now', 'ratio'))
+    for length in results['config']['lengths']:
+        key = str(length)
+        if key not in baseline['lengths']:
+            continue
+        old, new = baseline['lengths'][key], results['lengths'][key]
+        for name in OPERATIONS + ('steps_per_second',):
+            if name == 'steps_per_second':
+                before, now = old[name], new[name]
+                # fewer steps a second is slower
+                ratio = before / now if now else float('inf')
+            else:
+                before, now = old[name]['best'], new[name]['best']
+                ratio = now / before if before else float('inf')
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  SLOWER'
+                regressions.append((length, name, ratio))
+            print("{0:>8} {1:<15} {2:>11.2f} {3:>11.2f} {4:>7.2f}{5}".format(
+                length, name, before, now, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GreedySnake benchmark")
+    parser.add_argument('--columns', type=int, default=COLUMNS)
+    parser.add_argument('--rows', type=int, default=ROWS)
+    parser.add_argument('--lengths', type=int, nargs='+',
+                        help="snake lengths to time, 10 to the whole board "
+                             "by default")
+    parser.add_argument('--samples', type=int, default=200,
+                        help="times each operation is run per round")
+    parser.add_argument('--rounds', type=int, default=5,
+                        help="rounds of samples per length")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="write the results as JSON here")
+    parser.add_argument('--compare', help="a saved baseline to compare with")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="how much slower than the baseline is a "
+                             "regression, 0.5 for 50%%")
+    args = parser.parse_args(argv)
+
+    if not has_cycle(args.columns, args.rows):
+        parser.error("the autopilot needs a board with an even number of "
+                     "columns or rows")
+    cells = args.columns * args.rows
+    lengths = args.lengths or get_lengths(args.columns, args.rows)
+    if any(not 0 < length <= cells - 2 for length in lengths):
+        parser.error("lengths must be from 1 to {0}".format(cells - 2))
+    results = run(args.columns, args.rows, sorted(lengths), args.samples,
+                  args.rounds, args.seed)
+    print_results(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("{0} regressions".format(len(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,742 @@
+# -*- encoding: utf-8 -*-
+
+# The rules of Greedy Snake without any display, for running games
+# headless. GreedySnake.py draws these games with pygame. BatchSnake steps
+# many games at once with numpy.
+
+import enum
+import random
+from array import array
+from collections import deque
+
+try:
+    import numpy
+except ImportError:     # BatchSnake needs numpy, the rest does not
+    numpy = None
+
+ROWS = 35
+COLUMNS = 40
+APPLE_SCORE = 5
+
+
+@enum.unique
+class Direction(enum.IntEnum):
+    UP = -1
+    DOWN = 1
+    LEFT = -2
+    RIGHT = 2
+
+
+def is_opposite_direction(d1, d2):
+    return d1 + d2 == 0
+
+
+# A read-only view of the body of a Snake, from the neck to the tail, as
+# (col, row) pairs.
+class SnakeBody(object):
+
+    def __init__(self, snake):
+        self.snake = snake
+
+    def __len__(self):
+        return self.snake.length
+
+    def __iter__(self):
+        snake = self.snake
+        cols, ring, capacity = snake.cols, snake.ring, snake.capacity
+        for i in range(snake.neck, snake.neck + snake.length):
+            cell = ring[i % capacity]
+            yield (cell % cols, cell // cols)
+
+    def __contains__(self, pos):
+        col, row = pos
+        snake = self.snake
+        if not (0 <= col < snake.cols and 0 <= row < snake.rows):
+            return False
+        cell = row*snake.cols + col
+        count = snake.occupancy[cell]
+        if snake.head[0] == col and snake.head[1] == row:
+            count -= 1
+        return count > 0 and snake.owner[cell] == snake.number
+
+
+# The cells of a board, shared by the snakes on it. occupancy counts the
+# parts of snakes on each cell, more than one only once a snake has run into
+# itself or into another, and owner is the number of the snake on it. The
+# free cells are also kept in a dense list, for picking one at random, and
+# free_index maps every cell to its position in that list, or -1 if a snake
+# occupies it.
+class Grid(object):
+
+    def __init__(self, cols, rows):
+        self.cols, self.rows = cols, rows
+        self.cells = cols * rows
+        self.occupancy = bytearray(self.cells)
+        self.owner = bytearray(self.cells)
+        self.free_cells = array('i', range(self.cells))
+        self.free_index = array('i', range(self.cells))
+
+    def get_free_cell_count(self):
+        return len(self.free_cells)
+
+    def get_random_free_cell(self):
+        cell = random.choice(self.free_cells)
+        return (cell % self.cols, cell // self.cols)
+
+
+# A snake on grid, a Grid of its own by default. number tells the snakes of
+# a grid apart, col is the column it starts on, going up from the bottom.
+class Snake(object):
+
+    GROWING_STEPS = 4
+
+    def __init__(self, cols, rows, grid=None, number=0, col=None):
+        self.cols, self.rows = cols, rows
+        if col is None:
+            col = cols//2
+        self.col = col      # the column it starts in
+        self.head = [col, rows-2]
+        # The body is a ring buffer of cell numbers (row*cols + col) as big
+        # as the board, from ring[neck] for the neck to length cells later
+        # for the tail.
+        self.capacity = cols * rows
+        self.ring = array('i', bytes(4 * self.capacity))
+        self.neck = 0
+        self.length = 1
+        self.ring[0] = (rows-1)*cols + col
+        self.body = SnakeBody(self)
+        self.direction = Direction.UP
+        self.growing = False
+        self.turning = False
+        self.growing_steps = Snake.GROWING_STEPS
+        self.grid = Grid(cols, rows) if grid is None else grid
+        self.number = number
+        self.occupancy = self.grid.occupancy
+        self.owner = self.grid.owner
+        self.free_cells = self.grid.free_cells
+        self.free_index = self.grid.free_index
+        self.occupy_cell(self.get_head_cell())
+        self.occupy_body()
+
+    def init(self):
+        # Starts again on the same grid, where its cells are freed first.
+        self.remove()
+        Snake.__init__(self, self.cols, self.rows, self.grid, self.number, self.col)
+
+    def occupy_body(self):
+        for i in range(self.length):
+            self.occupy_cell(self.ring[(self.neck + i) % self.capacity])
+
+    def free_body(self):
+        for i in range(self.length):
+            self.free_cell(self.ring[(self.neck + i) % self.capacity])
+
+    def remove(self):
+        # Frees every cell of the snake on its grid, e.g. once it is dead.
+        if self.is_on_board():
+            self.free_cell(self.get_head_cell())
+        self.free_body()
+        self.length = 0
+
+    def occupy_cell(self, cell):
+        self.occupancy[cell] += 1
+        if self.occupancy[cell] > 1:
+            return
+        self.owner[cell] = self.number
+        i = self.free_index[cell]
+        last = self.free_cells.pop()
+        if last != cell:
+            self.free_cells[i] = last
+            self.free_index[last] = i
+        self.free_index[cell] = -1
+
+    def free_cell(self, cell):
+        self.occupancy[cell] -= 1
+        if self.occupancy[cell] == 0:
+            self.free_index[cell] = len(self.free_cells)
+            self.free_cells.append(cell)
+
+    def is_free_cell(self, col, row):
+        return self.occupancy[row*self.cols + col] == 0
+
+    def is_on_board(self):
+        col, row = self.head
+        return 0 <= col < self.cols and 0 <= row < self.rows
+
+    def is_collided(self):
+        # Whether the head is on a cell of the body. An out of board head
+        # is not counted.
+        return self.is_on_board() and self.occupancy[self.get_head_cell()] > 1
+
+    def get_free_cell_count(self):
+        return len(self.free_cells)
+
+    def get_random_free_cell(self):
+        return self.grid.get_random_free_cell()
+
+    def get_head(self):
+        return self.head
+
+    def get_body(self):
+        return self.body
+
+    def get_head_cell(self):
+        return self.head[1]*self.cols + self.head[0]
+
+    def get_tail(self):
+        cell = self.ring[(self.neck + self.length - 1) % self.capacity]
+        return (cell % self.cols, cell // self.cols)
+
+    def lay(self, cells):
+        # Replaces the body with cells, cell numbers from the neck to the
+        # tail, the neck next to the head. The snake goes on away from its
+        # neck.
+        self.free_body()
+        self.neck = 0
+        self.length = len(cells)
+        self.ring[:self.length] = array('i', cells)
+        moves = {-self.cols: Direction.UP, self.cols: Direction.DOWN,
+                 -1: Direction.LEFT, 1: Direction.RIGHT}
+        self.direction = moves[self.get_head_cell() - cells[0]]
+        self.growing = False
+        self.turning = False
+        self.occupy_body()
+
+    def turn(self, direction):
+        if not isinstance(direction, Direction):
+            raise TypeError("Invalid direction")
+        if not is_opposite_direction(self.direction, direction) and not self.turning:
+            self.direction = direction
+            self.turning = True
+
+    def grow(self):
+        self.growing = True
+        self.growing_steps = Snake.GROWING_STEPS
+
+    def go_ahead(self):
+        self.neck = (self.neck - 1) % self.capacity
+        self.ring[self.neck] = self.get_head_cell()
+        self.length += 1
+        if self.direction == Direction.UP:
+            self.head[1] -= 1
+        elif self.direction == Direction.DOWN:
+            self.head[1] += 1
+        elif self.direction == Direction.LEFT:
+            self.head[0] -= 1
+        elif self.direction == Direction.RIGHT:
+            self.head[0] += 1
+        if self.turning:
+            self.turning = False
+
+    def run(self):
+        # A snake off the board is dead, and its head has no cell number.
+        if not self.is_on_board():
+            return
+        self.go_ahead()
+        if self.growing and self.length < self.capacity:
+            self.growing_steps -= 1
+            self.growing = not (self.growing_steps == 0)
+        else:
+            self.length -= 1
+            self.free_cell(self.ring[(self.neck + self.length) % self.capacity])
+        # after freeing the tail, which the head may have just moved into
+        if self.is_on_board():
+            self.occupy_cell(self.get_head_cell())
+
+
+class GameState(enum.Enum):
+    PLAYING = 0
+    PAUSE = 1
+    WIN = 2
+    FAIL = 3
+
+
+# A game of Greedy Snake stepped by hand, one move of the snake at a time.
+class SnakeGame(object):
+
+    def __init__(self, cols=COLUMNS, rows=ROWS):
+        self.cols, self.rows = cols, rows
+        self.init()
+
+    def init(self):
+        self.state = GameState.PLAYING
+        self.snake = self.new_snake()
+        self.apple = self.get_apple()
+        self.score = 0
+
+    def new_snake(self):
+        return Snake(self.cols, self.rows)
+
+    def get_apple(self):
+        # The (col, row) of a new apple, on a cell the snake is not on.
+        if self.is_win() or self.snake.get_free_cell_count() == 0:
+            return None
+        return self.snake.get_random_free_cell()
+
+    def is_win(self):
+        return len(self.snake.get_body()) + 1 == self.rows * self.cols
+
+    def is_fail(self):
+        col, row = self.snake.get_head()
+        return (not 0 <= col < self.cols) or (
+                not 0 <= row < self.rows) or self.snake.is_collided()
+
+    def step(self, direction=None):
+        # Turns the snake to direction, if given, moves it one cell and
+        # checks the result. Returns the state.
+        if self.state == GameState.PLAYING:
+            if direction is not None:
+                self.snake.turn(direction)
+            self.snake.run()
+            self.check()
+        return self.state
+
+    def check(self):
+        # Eats the apple under the head, then checks for the end of the game.
+        if self.apple is not None and tuple(self.snake.get_head()) == self.apple:
+            self.snake.grow()
+            self.apple = self.get_apple()
+            self.score += APPLE_SCORE
+            self.on_eat()
+        if self.is_win():
+            self.state = GameState.WIN
+            self.on_win()
+        elif self.is_fail():
+            self.state = GameState.FAIL
+            self.on_fail()
+
+    # called by check(), for subclasses to show what happened
+    def on_eat(self):
+        pass
+
+    def on_win(self):
+        pass
+
+    def on_fail(self):
+        pass
+
+
+# Several snakes on one board, sharing its Grid: a snake has run into
+# another, or into itself, when the occupancy of the cell of its head is
+# more than one, so a step costs the same for each snake however many there
+# are. apple_count apples lie on the board at once. The arena is won by the
+# last snake left, or by filling the board, and lost once no snake is left.
+# new_snake(number, grid, col) makes the snakes, SnakeCore.Snake by default.
+class SnakeArena(object):
+
+    MAX_SNAKES = 255    # numbers fit in the bytes of Grid.owner
+
+    _moves = {
+        Direction.UP: (0, -1),
+        Direction.DOWN: (0, 1),
+        Direction.LEFT: (-1, 0),
+        Direction.RIGHT: (1, 0),
+    }
+
+    def __init__(self, count, cols=COLUMNS, rows=ROWS, apple_count=3, new_snake=None):
+        if not 0 < count <= min(cols, SnakeArena.MAX_SNAKES):
+            raise ValueError("Invalid number of snakes {0}".format(count))
+        self.count = count
+        self.cols, self.rows = cols, rows
+        self.apple_count = apple_count
+        if new_snake is None:
+            new_snake = lambda number, grid, col: Snake(cols, rows, grid, number, col)
+        self.new_snake = new_snake
+        self.init()
+
+    def init(self):
+        self.state = GameState.PLAYING
+        self.grid = Grid(self.cols, self.rows)
+        self.snakes = [self.new_snake(i, self.grid, (2*i + 1)*self.cols // (2*self.count))
+                       for i in range(self.count)]
+        self.alive = [True] * self.count
+        self.scores = [0] * self.count
+        self.apples = set()
+        for _ in range(self.apple_count):
+            self.add_apple()
+        # what the last step did: the snakes that died, the apples added
+        self.dead = []
+        self.new_apples = []
+
+    def add_apple(self):
+        # Puts an apple on a random free cell without one. Returns its
+        # (col, row), None if there is no such cell.
+        if self.grid.get_free_cell_count() <= len(self.apples):
+            return None
+        apple = self.grid.get_random_free_cell()
+        while apple in self.apples:
+            apple = self.grid.get_random_free_cell()
+        self.apples.add(apple)
+        return apple
+
+    def get_alive_count(self):
+        return self.alive.count(True)
+
+    def get_winner(self):
+        # The number of the last snake left, None if there is none.
+        if self.get_alive_count() != 1:
+            return None
+        return self.alive.index(True)
+
+    def step(self, directions=None):
+        # Turns every snake left to its direction in directions, if not
+        # None, moves them all one cell, then checks the result. Returns the
+        # state.
+        if self.state != GameState.PLAYING:
+            return self.state
+        moving = [i for i in range(self.count) if self.alive[i]]
+        for i in moving:
+            if directions is not None and directions[i] is not None:
+                self.snakes[i].turn(directions[i])
+            self.snakes[i].run()
+        self.check(moving)
+        return self.state
+
+    def check(self, moving):
+        # Every snake has moved and freed the cell of its tail, so a count
+        # above one under a head is a collision with a body or a head, and
+        # a snake that moved into a tail just left is fine.
+        grid = self.grid
+        self.dead = [i for i in moving if self.is_dead(self.snakes[i])]
+        eaten = 0
+        for i in moving:
+            snake = self.snakes[i]
+            if i in self.dead:
+                continue
+            # the cell may have been entered by a snake that died on it
+            grid.owner[snake.get_head_cell()] = i
+            head = tuple(snake.get_head())
+            if head in self.apples:
+                self.apples.remove(head)
+                snake.grow()
+                self.scores[i] += APPLE_SCORE
+                eaten += 1
+        for i in self.dead:
+            self.alive[i] = False
+            self.snakes[i].remove()
+        self.new_apples = [apple for apple in
+                           (self.add_apple() for _ in range(eaten))
+                           if apple is not None]
+        alive = self.get_alive_count()
+        if grid.get_free_cell_count() == 0 or (self.count > 1 and alive == 1):
+            self.state = GameState.WIN
+        elif alive == 0:
+            self.state = GameState.FAIL
+
+    def is_dead(self, snake):
+        return not snake.is_on_board() or snake.is_collided()
+
+    def steer(self, number):
+        # A Direction taking snake number to a free cell next to its head,
+        # the one nearest to an apple. None, to go on straight, if no cell
+        # is free.
+        snake = self.snakes[number]
+        cols, rows, occupancy = self.cols, self.rows, self.grid.occupancy
+        col, row = snake.get_head()
+        best, best_distance = None, None
+        for direction, (dc, dr) in SnakeArena._moves.items():
+            c, r = col + dc, row + dr
+            if (is_opposite_direction(direction, snake.direction) or
+                    not (0 <= c < cols and 0 <= r < rows) or occupancy[r*cols + c]):
+                continue
+            distance = min([abs(ac - c) + abs(ar - r) for ac, ar in self.apples] or [0])
+            if best is None or distance < best_distance:
+                best, best_distance = direction, distance
+        return best
+
+
+def has_cycle(cols, rows):
+    # Whether make_cycle() can walk the board, which an Autopilot needs:
+    # a board with both sides odd has no Hamiltonian cycle.
+    return cols >= 2 and rows >= 2 and not (cols % 2 and rows % 2)
+
+
+def make_cycle(cols, rows):
+    # A Hamiltonian cycle of the board, as cell numbers in order: down the
+    # first column, up and down the other columns below the first row, and
+    # back along the first row. That needs an even number of columns, else
+    # the board is walked the same way with rows and columns swapped.
+    if not has_cycle(cols, rows):
+        raise ValueError(
+            "A {0}x{1} board has no Hamiltonian cycle".format(cols, rows))
+    if cols % 2 == 0:
+        width, height, to_cell = cols, rows, lambda x, y: y*cols + x
+    else:
+        width, height, to_cell = rows, cols, lambda x, y: x*cols + y
+    cycle = array('i', (to_cell(0, y) for y in range(height)))
+    for x in range(1, width):
+        ys = range(height-1, 0, -1) if x % 2 else range(1, height)
+        cycle.extend(to_cell(x, y) for y in ys)
+    cycle.extend(to_cell(x, 0) for x in range(width-1, 0, -1))
+    return cycle
+
+
+# Steers a Snake to a win. The snake follows a Hamiltonian cycle of the
+# board, so that its body always lies along the cycle, from the tail to the
+# head, and the cells ahead of the head up to the tail are free. Moving the
+# head further along the cycle than the next cell skips cells, which the
+# tail frees only once it has gone along the whole body. Such a shortcut is
+# taken only while the snake fills less than half of the board, and when
+# the cells left ahead outnumber the body plus the growth pending and that
+# of four more apples, so that the head cannot catch up with the tail
+# before the skipped cells are free again.
+#
+# A shortest path to the apple is searched once per apple, and its steps are
+# taken as long as they are safe shortcuts. Past that, the snake takes the
+# longest safe shortcut not going past the apple.
+class Autopilot(object):
+
+    # cells a search may visit, so that it stays cheap on big boards
+    SEARCH_LIMIT = 4096
+
+    def __init__(self, cols, rows):
+        self.cols, self.rows = cols, rows
+        self.cells = cols * rows
+        cycle = make_cycle(cols, rows)
+        # a new snake must not have to turn back to its neck
+        head = (rows-2)*cols + cols//2
+        neck = (rows-1)*cols + cols//2
+        if cycle[(cycle.index(head) + 1) % self.cells] == neck:
+            cycle.reverse()
+        self.cycle = cycle
+        self.order = array('i', bytes(4 * self.cells))
+        self.next_cell = array('i', bytes(4 * self.cells))
+        order, next_cell, last = self.order, self.next_cell, cycle[-1]
+        for i, cell in enumerate(cycle):
+            order[cell] = i
+            next_cell[last] = cell
+            last = cell
+        self.reset()
+
+    def reset(self):
+        # Forgets the plan, for a new game.
+        self.apple = None
+        self.path = []
+
+    def is_on_cycle(self, snake):
+        # Whether the body of snake lies along the cycle, from the tail to
+        # the head, so that the autopilot can take it over.
+        order, cells = self.order, self.cells
+        head = order[snake.get_head_cell()]
+        behind = 0
+        for i in range(snake.neck, snake.neck + snake.length):
+            distance = (head - order[snake.ring[i % snake.capacity]]) % cells
+            if distance <= behind:
+                return False
+            behind = distance
+        return True
+
+    def lay_snake(self, snake, length):
+        # Gives snake a body of length cells along the cycle, behind its
+        # head, e.g. to start with a long snake.
+        if not 0 < length < self.cells:
+            raise ValueError("Invalid length {0}".format(length))
+        cycle, cells = self.cycle, self.cells
+        head = self.order[snake.get_head_cell()]
+        snake.lay([cycle[(head - i) % cells] for i in range(1, length + 1)])
+
+    def get_direction(self, snake, apple):
+        # The Direction to turn snake to before its next move. apple is the
+        # (col, row) of the apple, or None.
+        if apple != self.apple:
+            self.apple = apple
+            self.path = self.find_path(snake, apple)
+        head = snake.get_head_cell()
+        apple_cell = None if apple is None else apple[1]*self.cols + apple[0]
+        if self.path:
+            cell = self.path.pop()
+            if self.is_next_to(head, cell) and self.is_safe(snake, apple_cell, cell):
+                return self.get_move(head, cell)
+            self.path = []
+        return self.get_move(head, self.find_shortcut(snake, apple_cell))
+
+    def find_path(self, snake, apple):
+        # A shortest path from the head of snake to apple over free cells,
+        # as a stack of cells, the next one last. Empty if none is found
+        # within SEARCH_LIMIT cells.
+        if apple is None:
+            return []
+        cols, rows = self.cols, self.rows
+        head = snake.get_head_cell()
+        goal = apple[1]*cols + apple[0]
+        came_from = {head: -1}
+        queue = deque([head])
+        while queue and len(came_from) < Autopilot.SEARCH_LIMIT:
+            cell = queue.popleft()
+            if cell == goal:
+                path = []
+                while cell != head:
+                    path.append(cell)
+                    cell = came_from[cell]
+                return path
+            col = cell % cols
+            for other, on_board in ((cell - cols, cell >= cols),
+                                    (cell + cols, cell < (rows-1)*cols),
+                                    (cell - 1, col > 0),
+                                    (cell + 1, col < cols-1)):
+                if on_board and other not in came_from and not snake.occupancy[other]:
+                    came_from[other] = cell
+                    queue.append(other)
+        return []
+
+    def find_shortcut(self, snake, apple):
+        # The safe move of snake furthest along the cycle, not going past
+        # the cell number apple.
+        order, cells, cols = self.order, self.cells, self.cols
+        head = snake.get_head_cell()
+        best, best_ahead = self.next_cell[head], 1
+        col = head % cols
+        for cell, on_board in ((head - cols, head >= cols),
+                               (head + cols, head < cells - cols),
+                               (head - 1, col > 0),
+                               (head + 1, col < cols-1)):
+            if on_board:
+                ahead = (order[cell] - order[head]) % cells
+                if ahead > best_ahead and self.is_safe(snake, apple, cell):
+                    best, best_ahead = cell, ahead
+        return best
+
+    def is_safe(self, snake, apple, cell):
+        # Whether moving the head of snake to the next cell keeps enough
+        # free cells ahead of it. apple is a cell number or None.
+        order, cells = self.order, self.cells
+        head = order[snake.get_head_cell()]
+        ahead = (order[cell] - head) % cells
+        if ahead == 1:
+            return True
+        if snake.occupancy[cell] or snake.length*2 >= cells:
+            return False
+        if apple is not None and ahead > (order[apple] - head) % cells:
+            return False
+        tail = snake.ring[(snake.neck + snake.length - 1) % snake.capacity]
+        growth = snake.growing_steps if snake.growing else 0
+        if cell == apple:
+            growth = Snake.GROWING_STEPS
+        margin = snake.length + 4*Snake.GROWING_STEPS
+        return ahead + growth + margin < (order[tail] - head) % cells
+
+    def is_next_to(self, cell, other):
+        cols = self.cols
+        if abs(cell - other) == cols:
+            return True
+        return abs(cell - other) == 1 and cell // cols == other // cols
+
+    def get_move(self, head, cell):
+        # The Direction from the cell head to the cell next to it.
+        if cell == head - self.cols:
+            return Direction.UP
+        if cell == head + self.cols:
+            return Direction.DOWN
+        if cell == head - 1:
+            return Direction.LEFT
+        return Direction.RIGHT
+
+
+# Steps `count` games of the same size at once, with the rules of
+# SnakeGame, keeping the games in numpy arrays:
+#   head     --> (count, 2) col and row of the heads
+#   enter    --> (count, cells) step at which the head last entered each
+#                cell. A cell is occupied while enter >= steps - length,
+#                since the body is the last `length` cells entered.
+#   apple    --> (count,) cell number of the apples, -1 for none
+# Cells are numbered row*cols + col, like in Snake.
+class BatchSnake(object):
+
+    # Moves of each Direction, indexed by direction + 2.
+    _deltas = ((-1, 0), (0, -1), (0, 0), (0, 1), (1, 0))
+
+    def __init__(self, count, cols=COLUMNS, rows=ROWS, seed=None):
+        if numpy is None:
+            raise ImportError("BatchSnake needs numpy")
+        self.count = count
+        self.cols, self.rows = cols, rows
+        self.cells = cols * rows
+        self.random = numpy.random.default_rng(seed)
+        self.deltas = numpy.array(BatchSnake._deltas, dtype=numpy.int64)
+        self.head          = numpy.zeros((count, 2), dtype=numpy.int64)
+        self.direction     = numpy.zeros(count, dtype=numpy.int64)
+        self.length        = numpy.zeros(count, dtype=numpy.int64)
+        self.growing_steps = numpy.zeros(count, dtype=numpy.int64)
+        self.steps         = numpy.zeros(count, dtype=numpy.int64)
+        self.enter         = numpy.zeros((count, self.cells), dtype=numpy.int32)
+        self.apple         = numpy.zeros(count, dtype=numpy.int64)
+        self.score         = numpy.zeros(count, dtype=numpy.int64)
+        self.state         = numpy.zeros(count, dtype=numpy.int64)
+        self.init()
+
+    def init(self, games=None):
+        # Starts the given games again (a bool mask or indices), all of
+        # them by default, like SnakeGame.init().
+        if games is None:
+            games = numpy.arange(self.count)
+        games = numpy.arange(self.count)[games]
+        cols, rows = self.cols, self.rows
+        self.head[games] = (cols//2, rows-2)
+        self.direction[games] = Direction.UP
+        self.length[games] = 1
+        self.growing_steps[games] = 0
+        self.steps[games] = 0
+        self.enter[games] = -self.cells - 2     # long before anything
+        self.enter[games, (rows-2)*cols + cols//2] = 0
+        self.enter[games, (rows-1)*cols + cols//2] = -1
+        self.score[games] = 0
+        self.state[games] = GameState.PLAYING.value
+        self.apple[games] = self.get_apples(games)
+
+    def get_occupancy(self):
+        # (count, rows, cols) bools, whether each cell is occupied.
+        occupied = self.enter >= (self.steps - self.length)[:, None]
+        return occupied.reshape(self.count, self.rows, self.cols)
+
+    def get_apples(self, games):
+        # A random free cell for each of the given games, -1 if none is.
+        free = self.enter[games] < (self.steps[games] - self.length[games])[:, None]
+        weights = self.random.random(free.shape)
+        weights[~free] = -1.0
+        apples = weights.argmax(axis=1)
+        apples[~free.any(axis=1)] = -1
+        return apples
+
+    def step(self, actions=None):
+        # Moves every game still playing one cell. actions holds a
+        # Direction (as an int) for each game, 0 to keep going straight;
+        # turning back is ignored, as by Snake.turn(). Returns the games
+        # that ate an apple in this step, as bools.
+        playing = self.state == GameState.PLAYING.value
+        if actions is not None:
+            actions = numpy.asarray(actions, dtype=numpy.int64)
+            turn = playing & (actions != 0) & (actions + self.direction != 0)
+            self.direction[turn] = actions[turn]
+
+        # Snake.run(): the body gains the old head, and keeps its tail
+        # while growing.
+        games = numpy.flatnonzero(playing)
+        growing = self.growing_steps[games] > 0
+        self.growing_steps[games] -= growing
+        self.length[games] += growing
+        self.steps[games] += 1
+        head = self.head[games] + self.deltas[self.direction[games] + 2]
+        self.head[games] = head
+
+        # Game.is_fail(): off the board, or on a cell of the body
+        cols, rows = self.cols, self.rows
+        on_board = ((head[:, 0] >= 0) & (head[:, 0] < cols) &
+                    (head[:, 1] >= 0) & (head[:, 1] < rows))
+        cell = numpy.where(on_board, head[:, 1]*cols + head[:, 0], 0)
+        collided = on_board & (self.enter[games, cell] >=
+                               self.steps[games] - self.length[games])
+        failed = ~on_board | collided
+        moved = games[~failed]
+        self.enter[moved, cell[~failed]] = self.steps[moved]
+
+        # Game.run(): eat the apple under the head, then check for the end
+        ate = numpy.zeros(self.count, dtype=bool)
+        ate[moved] = cell[~failed] == self.apple[moved]
+        eaten = numpy.flatnonzero(ate)
+        self.growing_steps[eaten] = Snake.GROWING_STEPS
+        self.score[eaten] += APPLE_SCORE
+        self.apple[eaten] = self.get_apples(eaten)
+        won = self.length[games] + 1 == self.cells
+        self.state[games[won]] = GameState.WIN.value
+        self.state[games[failed & ~won]] = GameState.FAIL.value
+        return ate
@@ -1,25 +1,34 @@
 #! /usr/bin/env python
 # -*- encoding: utf-8 -*-
 
+import argparse
 import random
 import sys
+from collections import OrderedDict
+
 import pygame
 from pygame.locals import *
 
+import TetrisCore
+from TetrisCore import *
+from TetrisAI import Autoplayer
+from TetrisReplay import Recorder, read_replay, play_headless
+
 # game configuration
 FPS               = 60        # frames per second
+DIRTY_RECTS       = True      # update only the changed parts of the screen
+TEXT_CACHE_SIZE   = 128       # rendered texts kept by render_text()
 CELL_SIZE         = 17        # size of cells of a tetromino
-ROWS              = 20
-COLUMNS           = 10
-GAME_AREA_WIDTH   = COLUMNS * CELL_SIZE
-GAME_AREA_HEIGHT  = ROWS * CELL_SIZE
+MIN_CELL_SIZE     = 2         # cells of big boards shrink down to this
+MAX_SCREEN_WIDTH  = 1280      # big boards shrink their cells to fit in
+MAX_SCREEN_HEIGHT = 960
+MIN_SCREEN_WIDTH  = 16 * CELL_SIZE  # room for the help text
+MIN_SCREEN_HEIGHT = 20 * CELL_SIZE
 MENU_WIDTH        = 6 * CELL_SIZE
-MENU_HEIGHT       = GAME_AREA_HEIGHT
-SCREEN_WIDTH      = GAME_AREA_WIDTH + MENU_WIDTH
-SCREEN_HEIGHT     = GAME_AREA_HEIGHT
 NEXT_AREA_HEIGHT  = 5 * CELL_SIZE
 LEVEL_AREA_HEIGHT = 4 * CELL_SIZE
 GOAL_AREA_HEIGHT  = 4 * CELL_SIZE
+GRID_DOTS_SIZE    = 8         # smaller cells are drawn without grid dots
 
 TETROMINO_COLOR      = (244, 119,  89)
 BACKGROUND_COLOR     = ( 50,  50,  50)
@@ -41,6 +50,7 @@ Ghelp_text = (
     "{:>5s} --> {:<s}".format("RIGHT", "move right"),
     "{:>5s} --> {:<s}".format("DOWN", "soft drop"),
     "{:>5s} --> {:<s}".format("SPACE", "hard drop"),
+    "{:>5s} --> {:<s}".format("A", "autoplay on/off"),
     "",
     "Press <P> to begin"
 )
@@ -55,44 +65,6 @@ Ggame_over_text = (
     ""
 )
 
-# tetrominoes
-# Assuming all cells of a tetromino ard laid out on a
-# 4*4 grid, where each cell is either occupied or not.
-# And so that we can represent each tetromino as a si-
-# mple 16 bit integer. This idea come from
-# http://codeincomplete.com/posts/2011/10/10/javascript_tetris/
-Gtetrominoe_I = {
-    'blocks': (0x0F00, 0x2222, 0x00F0, 0x4444),
-}
-Gtetrominoe_J = {
-    'blocks': (0x8E00, 0x6440, 0x0E20, 0x44C0),
-}
-Gtetrominoe_L = {
-    'blocks': (0x2E00, 0x4460, 0x0E80, 0xC440),
-}
-Gtetrominoe_O = {
-    'blocks': (0x6600, 0x6600, 0x6600, 0x6600),
-}
-Gtetrominoe_S = {
-    'blocks': (0x6C00, 0x4620, 0x06C0, 0x8C40),
-}
-Gtetrominoe_T = {
-    'blocks': (0x4E00, 0x4640, 0x0E40, 0x4C40),
-}
-Gtetrominoe_Z = {
-    'blocks': (0xC600, 0x2640, 0x0C60, 0x4C80),
-}
-
-Gtetrominoes = (
-    Gtetrominoe_I,
-    Gtetrominoe_J,
-    Gtetrominoe_L,
-    Gtetrominoe_O,
-    Gtetrominoe_S,
-    Gtetrominoe_T,
-    Gtetrominoe_Z
-)
-
 # A simple function to choose a monospaced font. Maybe wrong :D
 def get_font():
     if sys.platform.startswith('linux'):
@@ -104,161 +76,188 @@ def get_font():
     else:
         return pygame.font.get_default_font()
 
-def set_static_var(varname, value):
-    def decorate(func):
-        setattr(func, varname, value)
-        return func
-    return decorate
-
-@set_static_var('tetrominoes', [])
-def random_tetromino():
-    # random_tetromino.tetrominoes must be initialized first
-    if random_tetromino.tetrominoes == []:
-        random_tetromino.tetrominoes = [
-            i for i in range(7) for _ in range(4)
-        ]
-        random.shuffle(random_tetromino.tetrominoes)
-    random_index = random_tetromino.tetrominoes.pop()
-    return Gtetrominoes[random_index]
-
-def map_to_each_cell(tetromino, grid_pos, direction, map_fn, aux_data=None):
-    # map_fn must have the form --> map_fn(grid_x, grid_y, aux_data)
-    # where grid_x and grid_y denotes the position of a cell of tetromino
-    bit   = 0x8000
-    block = tetromino['blocks'][direction]
-    col, row = 0, 0
-    grid_x, grid_y = grid_pos
-    while bit > 0:
-        if block & bit:
-            map_fn(grid_x+col, grid_y+row, aux_data)
-        col += 1
-        bit >>= 1
-        if (col == 4):
-            col = 0
-            row += 1
-
-def grid_pos_to_cell_rect(grid_x, grid_y):
-    return (grid_x*CELL_SIZE, grid_y*CELL_SIZE, CELL_SIZE, CELL_SIZE)
+# Rendering a text is much slower than blitting it, and the texts drawn
+# here rarely change, so rendered texts are kept in a small LRU cache.
+Gtext_cache = OrderedDict()
+
+def render_text(font, text, color, antialias=True):
+    key = (font, text, color, antialias)
+    texture = Gtext_cache.get(key)
+    if texture is None:
+        texture = font.render(text, antialias, color)
+        Gtext_cache[key] = texture
+        if len(Gtext_cache) > TEXT_CACHE_SIZE:
+            Gtext_cache.popitem(last=False)
+    else:
+        Gtext_cache.move_to_end(key)
+    return texture
+
+Gsys_fonts = {}
+
+def get_sys_font(size, bold=False, italic=False):
+    # The same font object must be reused for render_text() to hit its cache.
+    key = (size, bold, italic)
+    if key not in Gsys_fonts:
+        Gsys_fonts[key] = pygame.font.SysFont(get_font(), size, bold, italic)
+    return Gsys_fonts[key]
+
+# Where everything is drawn for a board of rows*columns cells. The board
+# is on the left, with cells shrunk from CELL_SIZE if the screen would get
+# too big, and the menu on the right.
+class Layout(object):
+
+    def __init__(self, rows=ROWS, columns=COLUMNS):
+        self.rows      = rows
+        self.columns   = columns
+        self.cell_size = max(MIN_CELL_SIZE, min(
+            CELL_SIZE,
+            (MAX_SCREEN_WIDTH - MENU_WIDTH) // columns,
+            MAX_SCREEN_HEIGHT // rows))
+        self.game_area_width  = columns * self.cell_size
+        self.game_area_height = rows * self.cell_size
+        self.screen_width  = max(MIN_SCREEN_WIDTH, self.game_area_width + MENU_WIDTH)
+        self.screen_height = max(MIN_SCREEN_HEIGHT, self.game_area_height)
+        self.menu_x = self.game_area_width
+
+    def get_screen_size(self):
+        return (self.screen_width, self.screen_height)
+
+    def cell_rect(self, grid_x, grid_y):
+        size = self.cell_size
+        return pygame.Rect(grid_x*size, grid_y*size, size, size)
+
+    def row_rect(self, row):
+        return pygame.Rect(0, row*self.cell_size, self.game_area_width, self.cell_size)
+
+    def next_rect(self, grid_x, grid_y):
+        # the next tetromino is shown at full size in the menu
+        return pygame.Rect(self.menu_x + (grid_x+1)*CELL_SIZE,
+                           (grid_y+2)*CELL_SIZE, CELL_SIZE, CELL_SIZE)
 
 def draw_cell(surface, cell_rect):
     pygame.draw.rect(surface, TETROMINO_COLOR, cell_rect, 0)
     pygame.draw.rect(surface, CELL_FRAME_COLOR, cell_rect, 1)
 
-def _draw_tetromino_aux(grid_x, grid_y, surface):
-    draw_cell(surface, grid_pos_to_cell_rect(grid_x, grid_y))
-
-def draw_tetromino(surface, grid_pos, tetromino, direction):
+def tetromino_rects(to_rect, tetromino, direction, grid_x, grid_y):
+    # to_rect is Layout.cell_rect or Layout.next_rect
+    return [to_rect(grid_x+col, grid_y+row)
+            for col, row in tetromino['cells'][direction]]
+
+# Drawing a cell takes two pygame.draw.rect() calls, so cells, ghost cells
+# and whole tetrominoes in each direction are drawn once for every cell size
+# into surfaces in the display format, and only blitted from then on.
+class Sprites(object):
+
+    def __init__(self, cell_size):
+        rect = pygame.Rect(0, 0, cell_size, cell_size)
+        self.cell = pygame.Surface(rect.size).convert()
+        draw_cell(self.cell, rect)
+        self.ghost = pygame.Surface(rect.size, SRCALPHA).convert_alpha()
+        self.ghost.fill((0, 0, 0, 0))
+        pygame.draw.rect(self.ghost, GHOST_COLOR, rect, 1)
+        # indexed by tetromino index, then by direction
+        self.tetrominoes = [[self._make_tetromino(self.cell, cells, cell_size)
+                             for cells in tetromino['cells']]
+                            for tetromino in Gtetrominoes]
+        self.ghosts = [[self._make_tetromino(self.ghost, cells, cell_size)
+                        for cells in tetromino['cells']]
+                       for tetromino in Gtetrominoes]
+
+    def _make_tetromino(self, cell, cells, cell_size):
+        # the 4*4 grid of a tetromino, transparent where it has no cell
+        surface = pygame.Surface((4*cell_size, 4*cell_size), SRCALPHA).convert_alpha()
+        surface.fill((0, 0, 0, 0))
+        for col, row in cells:
+            surface.blit(cell, (col*cell_size, row*cell_size))
+        return surface
+
+# Sprites are made the first time a cell size is drawn, once the display
+# mode is set.
+Gsprites = {}
+
+def get_sprites(cell_size):
+    if cell_size not in Gsprites:
+        Gsprites[cell_size] = Sprites(cell_size)
+    return Gsprites[cell_size]
+
+def draw_tetromino(surface, to_rect, grid_pos, tetromino, direction):
     # grid_pos means the (left, top) of the 4*4 grid
-    map_to_each_cell(tetromino, grid_pos, direction, _draw_tetromino_aux, surface)
-
-# This class manages level and grade.
-class Level(object):
-
-    _level_pos = (GAME_AREA_WIDTH + CELL_SIZE*1.5,
-            NEXT_AREA_HEIGHT + CELL_SIZE*2)
-    _goal_pos  = (GAME_AREA_WIDTH + CELL_SIZE*2.5,
-            NEXT_AREA_HEIGHT + LEVEL_AREA_HEIGHT + CELL_SIZE*2)
-    _score_pos = (GAME_AREA_WIDTH + CELL_SIZE,
-            NEXT_AREA_HEIGHT + LEVEL_AREA_HEIGHT + GOAL_AREA_HEIGHT + CELL_SIZE*3)
-    _top_level = 15
-    _lines_needed_per_level = 3
-    _scores = (100, 300, 500, 800)
-    _init_speed = 0.6
-    _fasted_speed = 0.05
-    _speed_increment = (_fasted_speed-_init_speed)/float((_top_level-1))
-
-    def __init__(self, screen):
-        self._level = 1
-        self._goal  = 3
-        self._score = 0
-        self._speed = self._init_speed  # seconds needed to drop one row
-        self._screen = screen
-
-    def get_speed(self):
-        return self._speed
+    rect = to_rect(*grid_pos)
+    sprite = get_sprites(rect.width).tetrominoes[tetromino['index']][direction]
+    surface.blit(sprite, rect)
 
-    def get_score(self):
-        return self._score
+# Level rules from TetrisCore, plus drawing.
+class Level(TetrisCore.Level):
 
-    def add_score(self, score):
-        self._score += score
-
-    # used to add score according to lines removed
-    #   and to check if the player wins.
-    # score = self._scores[removed_lines-1] * (self._level*0.5 + 0.5)
-    def remove_lines(self, removed_lines):
-        score = self._scores[removed_lines-1] * (self._level*0.5 + 0.5)
-        self.add_score(int(score))
-        self._goal -= removed_lines
-        if self._goal <= 0:
-            return self._level_up()
-        return False
+    def __init__(self, screen, layout):
+        TetrisCore.Level.__init__(self)
+        self._screen = screen
+        menu_x = layout.menu_x
+        self._level_pos = (menu_x + CELL_SIZE*1.5,
+                NEXT_AREA_HEIGHT + CELL_SIZE*2)
+        self._goal_pos  = (menu_x + CELL_SIZE*2.5,
+                NEXT_AREA_HEIGHT + LEVEL_AREA_HEIGHT + CELL_SIZE*2)
+        self._score_pos = (menu_x + CELL_SIZE,
+                NEXT_AREA_HEIGHT + LEVEL_AREA_HEIGHT + GOAL_AREA_HEIGHT + CELL_SIZE*3)
 
     def draw(self, font):
-        level_texture = font.render("{0}/{1}".format(
-                str(self._level), self._top_level), True, LEVEL_FONT_COLOR)
-        goal_texture  = font.render(str(self._goal), True, LEVEL_FONT_COLOR)
-        grade_texture = font.render(str(self._score).zfill(6), True, LEVEL_FONT_COLOR)
+        level_texture = render_text(font, "{0}/{1}".format(
+                str(self._level), self._top_level), LEVEL_FONT_COLOR)
+        goal_texture  = render_text(font, str(self._goal), LEVEL_FONT_COLOR)
+        grade_texture = render_text(font, str(self._score).zfill(6), LEVEL_FONT_COLOR)
         self._screen.blit(level_texture, self._level_pos)
         self._screen.blit(goal_texture, self._goal_pos)
         self._screen.blit(grade_texture, self._score_pos)
 
-    def _level_up(self):
-        self._level += 1
-        if self._level == self._top_level + 1:
-            return True
-        self._goal = self._level * self._lines_needed_per_level
-        self._speed += self._speed_increment
-        return False
+# Draws a TetrisGame on the screen.
+class TetrisManager(TetrisGame):
 
-# Use this class to manage tetrominoes.
-class TetrisManager(object):
+    _next_pos = (0, 0)
 
-    _init_moving_pos = [3, 0]
-    _next_pos = [COLUMNS + 1, 2]
-
-    def __init__(self, screen, font):
-        self._grid           = [ [None]*COLUMNS for _ in range(ROWS) ]
-        self._curr_pos       = self._init_moving_pos[:]
-        self._direction      = 0
+    # rows and columns give the size of the board, the screen must be at
+    # least Layout(rows, columns).get_screen_size().
+    def __init__(self, screen, font, seed=None, rows=ROWS, columns=COLUMNS):
         self._screen         = screen
         self._font           = font
-        self._moving         = random_tetromino()
-        self._next           = random_tetromino()
-        self._time           = 0.0
-        self._level          = Level(screen)
-        self._is_pause       = True
-        self._is_win         = False
-        self._is_game_over   = False
-        self._pause_textures = self._get_pause_textures()
-
-    def set_time(self, time_passed_seconds):
-        self._time += time_passed_seconds
-
-    def get_speed(self):
-        return self._level.get_speed()
-
-    def is_pause(self):
-        return self._is_pause
-
-    def pause(self):
-        self._is_pause = not self._is_pause
+        self._layout         = Layout(rows, columns)
+        self._panel_rect     = pygame.Rect(self._layout.menu_x, NEXT_AREA_HEIGHT,
+                MENU_WIDTH, self._layout.screen_height - NEXT_AREA_HEIGHT)
+        self._sprites        = get_sprites(self._layout.cell_size)
+        self._last_frame     = None     # what draw_dirty() drew last time
+        self._autoplayer     = None
+        TetrisGame.__init__(self, seed, rows=rows, columns=columns)
+
+    def _new_level(self):
+        return Level(self._screen, self._layout)
+
+    def get_layout(self):
+        return self._layout
+
+    def toggle_autoplay(self, lookahead=True):
+        if self._autoplayer is None:
+            self._autoplayer = Autoplayer(lookahead=lookahead)
+        else:
+            self._autoplayer = None
 
-    def is_game_over(self):
-        return self._is_game_over
+    def get_autoplay_action(self):
+        # The next action of the autoplayer, or None if it is off.
+        if self._autoplayer is not None and not (
+                self._is_pause or self.is_over()):
+            return self._autoplayer.next_action(self)
+        return None
 
     def game_over(self):
         self._draw_game_over_text()
 
-    def is_win(self):
-        return self._is_win
-
     def win(self):
         self._draw_win_text()
 
     def draw_pause(self):
+        self._last_frame = None
         self._screen.fill(BACKGROUND_COLOR)
-        for i, texture in enumerate(self._pause_textures):
+        font = get_sys_font(CELL_SIZE)
+        for i, text in enumerate(Ghelp_text):
+            texture = render_text(font, text, HELP_TEXT_COLOR)
             self._screen.blit(texture, (CELL_SIZE*2, (i+2)*1.5*CELL_SIZE))
 
     def draw(self):
@@ -266,159 +265,105 @@ class TetrisManager(object):
         self._draw_curr_tetromino()
         self._draw_next_tetromino()
         self._level.draw(self._font)
-        for row in range(ROWS):
-            for col in range(COLUMNS):
-                if self._grid[row][col]:
-                    draw_cell(self._screen, grid_pos_to_cell_rect(col, row))
-
-    def restart(self):
-        self.__init__(self._screen, self._font)
-        self._is_pause = True
-
-    def remove_lines(self):
-        self._update_curr_tetromino()
-        removed_lines = self._check_lines()
-        if removed_lines > 0:
-            self._is_win = self._level.remove_lines(removed_lines)
-        return removed_lines
-
-    def drop_freely(self):
-        if (self._time > self.get_speed()):
-            self._time -= self.get_speed()
-            self._drop()
-
-    def softland(self):
-        y = self._curr_pos[1]
-        is_unoccupied = self.move('down')
-        self._add_score(self._curr_pos[1]-y)
-        if not is_unoccupied:
-            self.remove_lines()
-
-    def hardland(self):
-        y = self._curr_pos[1]
-        while self.move('down'):
-            pass
-        self._add_score((self._curr_pos[1]-y)*2)
-        self.remove_lines()
-
-    def move(self, direction):
+        self._draw_locked_rows(range(self._stack_top, self._layout.rows))
+
+    def draw_dirty(self, background):
+        # Like draw(), but on top of a pre-rendered background and only for
+        # what changed since the last call. Returns the rects to update.
+        last, frame = self._last_frame, self._get_frame(self._last_frame)
+        self._last_frame = frame
+        if last is None:
+            self._screen.blit(background, (0, 0))
+            self.draw()
+            return [self._screen.get_rect()]
+
+        layout = self._layout
+        dirty = []
+        for key in ('piece', 'ghost'):
+            if frame[key] != last[key]:
+                for rect in tetromino_rects(layout.cell_rect, *last[key]):
+                    self._screen.blit(background, rect, rect)
+                    dirty.append(rect)
+                dirty.extend(tetromino_rects(layout.cell_rect, *frame[key]))
+        # after erasing the tetromino, since it may have been locked there
+        if frame['grid'] is not last['grid']:
+            # rows above both stack tops are empty in both grids
+            rows = [row for row in range(min(frame['top'], last['top']), layout.rows)
+                    if frame['grid'][row] != last['grid'][row]]
+            for row in rows:
+                rect = layout.row_rect(row)
+                self._screen.blit(background, rect, rect)
+                dirty.append(rect)
+            self._draw_locked_rows(rows)
+        if dirty:
+            # the tetromino and its ghost never overlap locked cells
+            self._draw_ghost()
+            self._draw_curr_tetromino()
+
+        if frame['next'] != last['next']:
+            for rect in tetromino_rects(layout.next_rect, *last['next']):
+                self._screen.blit(background, rect, rect)
+                dirty.append(rect)
+            self._draw_next_tetromino()
+            dirty.extend(tetromino_rects(layout.next_rect, *frame['next']))
+        if frame['panel'] != last['panel']:
+            self._screen.blit(background, self._panel_rect, self._panel_rect)
+            self._level.draw(self._font)
+            dirty.append(self._panel_rect)
+        return dirty
+
+    def _get_frame(self, last):
+        # Everything draw_dirty() needs to tell what has changed. The grid
+        # is only copied when locked cells have changed.
         x, y = self._curr_pos
-        if direction == 'left':
-            x -= 1
-        elif direction == 'right':
-            x += 1
-        elif direction == 'down':
-            y += 1
-        else:
-            raise ValueError("direction must be 'left', 'right' or 'down'")
-
-        if self.is_unoccupied((x, y)):
-            self._curr_pos[0] = x
-            self._curr_pos[1] = y
-            return True
-        return False
-
-    def rotate(self):
-        old_direction = self._direction
-        old_pos = self._curr_pos[:]
-
-        self._direction = (self._direction+1) % 4
-        if not self.is_unoccupied(self._curr_pos):
-
-            for i in (1, 2, -1, -2):
-                self._curr_pos[0] += i
-                if self.is_unoccupied(self._curr_pos):
-                    return
-                self._curr_pos[0] -= i
-
-            self._direction = old_direction
-            self._curr_pos = old_pos
-
-    def is_unoccupied(self, pos):
-        result = []
-        map_to_each_cell(self._moving, pos,
-            self._direction, self._is_cell_unoccupied, result)
-        return all(result)
-
-    def _is_cell_unoccupied(self, x, y, result):
-        if (0 <= x < COLUMNS) and (0 <= y < ROWS) and self._get_block(x, y):
-            result.append(True)
-        else:
-            result.append(False)
-
-    def _get_block(self, x, y):
-        if self._grid[y][x] == None:
-            return True
-        else: return False
-
-    def _add_a_cell(self, x, y, aux_data=None):
-        self._grid[y][x] = True
-
-    def _add_curr_tetromino(self):
-        map_to_each_cell(self._moving, self._curr_pos, self._direction,
-            self._add_a_cell)
-
-    def _add_score(self, score):
-        self._level.add_score(score)
+        return {
+            'grid'    : self.get_grid(),
+            'top'     : self._stack_top,
+            'piece'   : (self._moving, self._direction, x, y),
+            'ghost'   : (self._moving, self._direction, x, self.get_ghost_row()),
+            'next'    : (self._next, 0) + tuple(self._next_pos),
+            'panel'   : (self._level.get_level(), self._level.get_goal(),
+                         self._level.get_score()),
+        }
+
+    def _draw_locked_rows(self, rows):
+        # All the locked cells of rows in a single blits() call. Only the
+        # occupied cells are visited, lowest bit first.
+        cell = self._sprites.cell
+        size = self._layout.cell_size
+        empty_row = self._board.empty_row
+        blits = []
+        for row in rows:
+            bits = (self._grid[row] & ~empty_row) >> GRID_PAD
+            y = row * size
+            while bits:
+                low = bits & -bits
+                blits.append((cell, ((low.bit_length()-1) * size, y)))
+                bits ^= low
+        self._screen.blits(blits, False)
 
     def _draw_curr_tetromino(self):
-        draw_tetromino(self._screen, self._curr_pos, self._moving, self._direction)
+        draw_tetromino(self._screen, self._layout.cell_rect, self._curr_pos,
+                       self._moving, self._direction)
 
     def _draw_next_tetromino(self):
-        draw_tetromino(self._screen, self._next_pos, self._next, 0)
-
-    def _draw_ghost_aux(self, x, y, aux_data=None):
-        pygame.draw.rect(self._screen, GHOST_COLOR, grid_pos_to_cell_rect(x, y), 1)
+        draw_tetromino(self._screen, self._layout.next_rect, self._next_pos,
+                       self._next, 0)
 
     def _draw_ghost(self):
-        old_pos = self._curr_pos[:]
-        while self.move('down'):
-            pass
-        map_to_each_cell(self._moving, self._curr_pos, self._direction,
-                         self._draw_ghost_aux)
-        self._curr_pos = old_pos
-
-    def _drop(self):
-        if not self.move('down'):
-            self.remove_lines()
-
-    def _check_lines(self):
-        removed_lines = 0
-        row = ROWS - 1
-        while row > 0:
-            if all(self._grid[row]):
-                for i in reversed(range(1, row+1)):
-                    self._grid[i] = self._grid[i-1][:]
-                row += 1        # check this line again since it was changed
-                removed_lines += 1
-            row -= 1
-        if all(self._grid[0]): self._grid[0] = [None] * COLUMNS
-        return removed_lines
-
-    def _update_curr_tetromino(self):
-        self._add_curr_tetromino()
-        self._moving = self._next
-        self._next = random_tetromino()
-        self._curr_pos = self._init_moving_pos[:]
-        self._direction = 0
-        if not self.is_unoccupied(self._curr_pos):
-            self._is_game_over = True
-
-    def _get_pause_textures(self):
-        font = pygame.font.SysFont(get_font(), CELL_SIZE, False, False)
-        textures = []
-        for text in Ghelp_text:
-            textures.append(font.render(text, True, HELP_TEXT_COLOR))
-        return textures
+        x, y = self._curr_pos[0], self.get_ghost_row()
+        sprite = self._sprites.ghosts[self._moving['index']][self._direction]
+        self._screen.blit(sprite, self._layout.cell_rect(x, y))
 
     def _draw_text(self, texts, color, size):
+        self._last_frame = None
         self._screen.fill(BACKGROUND_COLOR)
-        font = pygame.font.SysFont(get_font(), CELL_SIZE*2, True, True)
+        font = get_sys_font(CELL_SIZE*2, True, True)
         textures = []
         for text in texts:
-            textures.append(font.render(text, True, color))
+            textures.append(render_text(font, text, color))
         score_text = str(self._level.get_score()).center(size)
-        textures.append(font.render(score_text, True, color))
+        textures.append(render_text(font, score_text, color))
         for i, texture in enumerate(textures):
             self._screen.blit(texture, (CELL_SIZE*3, (i+6)*CELL_SIZE))
 
@@ -429,109 +374,168 @@ class TetrisManager(object):
         self._draw_text(Ggame_over_text, GAME_OVER_TEXT_COLOR, 10)
 
 # UI
-# TODO: The screen should be updated portion by portion
 # draw_fonts(screen, font)
 #     includes <Next>, <Level> and <Goal>
 # drae_background(screen)
 #     screen.fill(BACKGROUND_COLOR)
 #    draw_matrices(screen)
 
-def draw_fonts(screen, font):
-    next_texture  = font.render("Next", True, FONT_COLOR)
-    level_texture = font.render("Level", True, FONT_COLOR)
-    goal_texture  = font.render("Goal", True, FONT_COLOR)
+def draw_fonts(screen, font, layout):
+    next_texture  = render_text(font, "Next", FONT_COLOR)
+    level_texture = render_text(font, "Level", FONT_COLOR)
+    goal_texture  = render_text(font, "Goal", FONT_COLOR)
 
     screen.blit(next_texture,
-        (GAME_AREA_WIDTH + CELL_SIZE*1.5,
+        (layout.menu_x + CELL_SIZE*1.5,
          CELL_SIZE/2))
     screen.blit(level_texture,
-        (GAME_AREA_WIDTH + CELL_SIZE*1.5,
+        (layout.menu_x + CELL_SIZE*1.5,
          CELL_SIZE/2 + NEXT_AREA_HEIGHT))
     screen.blit(goal_texture,
-        (GAME_AREA_WIDTH + CELL_SIZE*1.5,
+        (layout.menu_x + CELL_SIZE*1.5,
          CELL_SIZE/2 + LEVEL_AREA_HEIGHT + NEXT_AREA_HEIGHT))
 
-def draw_matrices(screen):
-    for x in range(CELL_SIZE, GAME_AREA_WIDTH + 1, CELL_SIZE):
+def draw_matrices(screen, layout):
+    size, width, height = (layout.cell_size, layout.game_area_width,
+                           layout.game_area_height)
+    line_width = 2 if size >= GRID_DOTS_SIZE else 1
+    for x in range(size, width + 1, size):
         pygame.draw.line(screen, CELL_FRAME_COLOR,
-            (x, 0), (x, GAME_AREA_HEIGHT), 2)
+            (x, 0), (x, height), line_width)
 
-    for y in range(CELL_SIZE, GAME_AREA_HEIGHT, CELL_SIZE):
+    for y in range(size, height, size):
         pygame.draw.line(screen, CELL_FRAME_COLOR,
-            (0, y), (GAME_AREA_WIDTH, y), 2)
+            (0, y), (width, y), line_width)
 
-    for y in range(CELL_SIZE, GAME_AREA_HEIGHT, CELL_SIZE):
-        for x in range(CELL_SIZE, GAME_AREA_WIDTH, CELL_SIZE):
-            pygame.draw.circle(screen, CELL_FRAME_COLOR, (x, y), 3)
+    if size >= GRID_DOTS_SIZE:
+        for y in range(size, height, size):
+            for x in range(size, width, size):
+                pygame.draw.circle(screen, CELL_FRAME_COLOR, (x, y), 3)
 
-def draw_background(screen):
+def draw_background(screen, layout):
     screen.fill(BACKGROUND_COLOR)
-    draw_matrices(screen)
+    draw_matrices(screen, layout)
+
+# The background and the labels never change, so they are drawn once
+# and blitted back wherever something has to be erased.
+def make_background(screen, font, layout):
+    background = pygame.Surface(screen.get_size()).convert(screen)
+    draw_background(background, layout)
+    draw_fonts(background, font, layout)
+    return background
 
 # Handle game events
 #     Quit --> exit()
-#     KEYDOWN --> Gkeydown_handlers[event.key](event.key)
-def key_up_handler(manager):
-    manager.rotate()
-
-def key_down_handler(manager):
-    manager.softland()
-
-def key_left_handler(manager):
-    manager.move('left')
-
-def key_right_handler(manager):
-    manager.move('right')
-
-def key_space_handler(manager):
-    manager.hardland()
+#     KEYDOWN --> Gkey_actions[event.key] is queued to the simulation,
+#                 or Gkeydown_handlers[event.key](simulation) is called
+Gkey_actions = {
+    K_UP    : ACTION_ROTATE,
+    K_DOWN  : ACTION_SOFT_DROP,
+    K_LEFT  : ACTION_LEFT,
+    K_RIGHT : ACTION_RIGHT,
+    K_SPACE : ACTION_HARD_DROP,
+    K_p     : ACTION_PAUSE,
+    K_RETURN: ACTION_RESTART
+}
 
-def key_p_handler(manager):
-    manager.pause()
+def key_a_handler(simulation):
+    simulation.get_game().toggle_autoplay()
 
-def key_esc_handler(manager):
+def key_esc_handler(simulation):
     exit()
 
-def key_enter_handler(manager):
-    manager.restart()
-
 Gkeydown_handlers = {
-    K_UP    : key_up_handler,
-    K_DOWN  : key_down_handler,
-    K_LEFT  : key_left_handler,
-    K_RIGHT : key_right_handler,
-    K_SPACE : key_space_handler,
-    K_p     : key_p_handler,
-    K_ESCAPE: key_esc_handler,
-    K_RETURN: key_enter_handler
+    K_a     : key_a_handler,
+    K_ESCAPE: key_esc_handler
 }
 
-def handle_events(manager):
-    drop = True
+# While watching a replay, only ESC and closing the window do something.
+def handle_events(simulation, replaying=False):
     for event in pygame.event.get():
         if event.type == QUIT:
             pygame.quit()
             exit()
         if event.type == KEYDOWN:
-            Gkeydown_handlers.get(event.key, lambda _: None)(manager)
-            drop = False
-    if drop:
-        manager.drop_freely()
-
-def main():
+            if replaying:
+                if event.key == K_ESCAPE:
+                    key_esc_handler(simulation)
+            elif event.key in Gkey_actions:
+                simulation.queue(Gkey_actions[event.key])
+            else:
+                Gkeydown_handlers.get(event.key, lambda _: None)(simulation)
+    # one autoplayer action at a time, once the previous one was played
+    if not replaying and not simulation.has_pending():
+        action = simulation.get_game().get_autoplay_action()
+        if action is not None:
+            simulation.queue(action)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tetris")
+    parser.add_argument('--seed', type=int,
+                        help="seed of the tetrominoes, random by default")
+    parser.add_argument('--record', metavar='FILE',
+                        help="record the game to FILE")
+    parser.add_argument('--replay', metavar='FILE',
+                        help="watch the game recorded in FILE")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="how many times faster to play the replay")
+    parser.add_argument('--headless', action='store_true',
+                        help="play the replay without a display, at full speed")
+    parser.add_argument('--rows', type=int, default=ROWS)
+    parser.add_argument('--columns', type=int, default=COLUMNS)
+    args = parser.parse_args(argv)
+
+    replay = read_replay(args.replay) if args.replay else None
+    if replay is not None and args.headless:
+        state = play_headless(replay)
+        print("score {0}, {1} lines, {2} pieces".format(
+            state['score'], state['lines'], state['pieces']))
+        return
 
     pygame.display.init()
     pygame.font.init()
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), 0, 32)
+    # a replay is played on the board it was recorded on
+    if replay is not None:
+        rows, columns = replay.rows, replay.columns
+    else:
+        rows, columns = args.rows, args.columns
+    screen = pygame.display.set_mode(Layout(rows, columns).get_screen_size(), 0, 32)
     clock  = pygame.time.Clock()
-    font   = pygame.font.SysFont(get_font(), int(1.3*CELL_SIZE), False, True)
+    font   = get_sys_font(int(1.3*CELL_SIZE), False, True)
     pygame.key.set_repeat(100, 50)
-    manager = TetrisManager(screen, font)
+
+    recorder = None
+    if replay is not None:
+        manager = TetrisManager(screen, font, replay.seed, rows, columns)
+        simulation = replay.make_simulation(manager, speed=args.speed)
+    else:
+        seed = args.seed
+        if seed is None:
+            seed = random.randrange(2**31)
+        manager = TetrisManager(screen, font, seed, rows, columns)
+        if args.record:
+            recorder = Recorder(args.record, seed, rows=rows, columns=columns)
+        simulation = Simulation(manager, recorder=recorder)
+
+    try:
+        if DIRTY_RECTS:
+            main_dirty(screen, clock, font, simulation, replay is not None)
+        else:
+            main_full(screen, clock, font, simulation, replay is not None)
+    finally:
+        if recorder is not None:
+            recorder.close(simulation.get_ticks())
+
+# Redraws the whole screen every frame.
+def main_full(screen, clock, font, simulation, replaying):
+    manager = simulation.get_game()
+    background = make_background(screen, font, manager.get_layout())
 
     while True:
         time_passed_seconds = clock.tick(FPS)/1000.
         pygame.display.set_caption("Tetris    FPS: %.2f" % clock.get_fps())
-        handle_events(manager)
+        handle_events(simulation, replaying)
+        simulation.advance(time_passed_seconds)
         pygame.display.update()
 
         if not manager.is_pause():
@@ -540,12 +544,40 @@ def main():
             elif manager.is_game_over():
                 manager.game_over()
             else:
-                manager.set_time(time_passed_seconds)
-                draw_background(screen)
-                draw_fonts(screen, font)
+                screen.blit(background, (0, 0))
                 manager.draw()
         else:
             manager.draw_pause()
 
+# Same as main_full(), but the pause, win and game over screens are drawn
+# once, and while playing only the changed rects are updated.
+def main_dirty(screen, clock, font, simulation, replaying):
+    manager = simulation.get_game()
+    background = make_background(screen, font, manager.get_layout())
+    shown = None    # the full screen text being shown, if any
+
+    while True:
+        time_passed_seconds = clock.tick(FPS)/1000.
+        pygame.display.set_caption("Tetris    FPS: %.2f" % clock.get_fps())
+        handle_events(simulation, replaying)
+        simulation.advance(time_passed_seconds)
+
+        if manager.is_pause():
+            text_screen = manager.draw_pause
+        elif manager.is_win():
+            text_screen = manager.win
+        elif manager.is_game_over():
+            text_screen = manager.game_over
+        else:
+            text_screen = None
+
+        if text_screen is None:
+            shown = None
+            pygame.display.update(manager.draw_dirty(background))
+        elif text_screen != shown:
+            shown = text_screen
+            text_screen()
+            pygame.display.update()
+
 if __name__ == '__main__':
     main()
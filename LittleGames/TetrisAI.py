@@ -0,0 +1,227 @@
+#! /usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# An autoplayer for TetrisCore.TetrisGame. It tries every placement the
+# current tetromino can reach (and optionally the next one too), scores
+# the boards they leave with a weighted heuristic and plays the best one.
+
+from TetrisCore import *
+
+try:
+    import numpy
+except ImportError:     # boards are scored one by one without numpy
+    numpy = None
+
+# Weights of the board features, higher scores are better. These are the
+# ones found by Yiyuan Lee's genetic search, see
+# https://codemyroad.wordpress.com/2013/04/14/tetris-ai-the-near-perfect-player/
+DEFAULT_WEIGHTS = {
+    'height'    : -0.510066,    # sum of the column heights
+    'lines'     :  0.760666,    # lines removed by the placement
+    'holes'     : -0.35663,     # empty cells with a filled cell above
+    'bumpiness' : -0.184483,    # sum of height differences of neighbours
+}
+
+# Boards are scored with numpy if their rows fit in a numpy.uint64, with
+# the walls if possible and without them otherwise.
+def use_numpy(board):
+    return numpy is not None and board.columns <= 64
+
+def find_placements(board, grid, tetromino, direction, x, y):
+    # Every landing spot reachable from (x, y) by rotating first and then
+    # moving sideways, the way the actions produced by Autoplayer are
+    # played. Returns a list of (rotations, shift, direction, x, y), one
+    # per distinct landing spot.
+    placements = []
+    seen = set()
+    # Rows above the highest locked cell are empty, so the drops can start
+    # just above it instead of at y.
+    top = next((row for row in range(board.rows) if grid[row] != board.empty_row),
+               board.rows)
+    drop_from = max(y, top - 4)
+    for rotations in range(4):
+        if rotations > 0:
+            direction = (direction+1) % 4
+            for kick in (0,) + ROTATE_KICKS:
+                if board.fits(grid, tetromino, direction, x+kick, y):
+                    x += kick
+                    break
+            else:
+                break
+        for step in (-1, 1):
+            shift, col = 0, x
+            while board.fits(grid, tetromino, direction, col, y):
+                row = board.landing_row(grid, tetromino, direction, col, drop_from)
+                if (direction, col, row) not in seen:
+                    seen.add((direction, col, row))
+                    placements.append((rotations, shift, direction, col, row))
+                shift += step
+                col += step
+    return placements
+
+def lock(board, grid, tetromino, direction, x, y):
+    # The grid with the tetromino added and full rows removed, and the
+    # number of removed rows.
+    grid = list(grid)
+    shift = x + GRID_PAD
+    full = []
+    for dy, mask in tetromino['rows'][direction]:
+        grid[y+dy] |= mask << shift
+        if grid[y+dy] == board.full_row:
+            full.append(y+dy)
+    if full:
+        for row in reversed(full):
+            del grid[row]
+        grid[:0] = [board.empty_row] * len(full)
+    return grid, len(full)
+
+def get_features(board, grids):
+    # (height, holes, bumpiness) of each grid, as one row per grid.
+    if use_numpy(board):
+        return _get_features_numpy(board, grids)
+    return [_get_features(board, grid) for grid in grids]
+
+def _get_features(board, grid):
+    rows, columns = board.rows, board.columns
+    heights = [0] * columns
+    holes = 0
+    for col in range(columns):
+        bit = 1 << (col + GRID_PAD)
+        covered = False
+        for row in range(rows):
+            if grid[row] & bit:
+                if not covered:
+                    heights[col] = rows - row
+                    covered = True
+            elif covered:
+                holes += 1
+    bumpiness = sum(abs(heights[i] - heights[i+1]) for i in range(columns-1))
+    return (sum(heights), holes, bumpiness)
+
+def _get_features_numpy(board, grids):
+    if board.columns + GRID_PAD*2 <= 64:
+        rows = numpy.array(grids, dtype=numpy.uint64)
+        start = GRID_PAD
+    else:
+        # the walls do not fit, strip them first
+        rows = numpy.array([[(row & ~board.empty_row) >> GRID_PAD for row in grid]
+                            for grid in grids], dtype=numpy.uint64)
+        start = 0
+    shifts = numpy.arange(start, start + board.columns, dtype=numpy.uint64)
+    cells = ((rows[:, :, None] >> shifts) & numpy.uint64(1)).astype(bool)
+    filled = cells.any(axis=1)
+    heights = numpy.where(filled, board.rows - cells.argmax(axis=1), 0)
+    covered = numpy.logical_or.accumulate(cells, axis=1)
+    holes = (covered & ~cells).sum(axis=(1, 2))
+    bumpiness = numpy.abs(numpy.diff(heights, axis=1)).sum(axis=1)
+    return numpy.stack((heights.sum(axis=1), holes, bumpiness), axis=1)
+
+def score_grids(board, grids, lines, weights):
+    # Heuristic score of each grid, given the lines removed to reach it.
+    features = get_features(board, grids)
+    if use_numpy(board):
+        return (features[:, 0] * weights['height'] +
+                features[:, 1] * weights['holes'] +
+                features[:, 2] * weights['bumpiness'] +
+                numpy.asarray(lines) * weights['lines']).tolist()
+    return [height * weights['height'] + holes * weights['holes'] +
+            bumpiness * weights['bumpiness'] + n * weights['lines']
+            for (height, holes, bumpiness), n in zip(features, lines)]
+
+class Autoplayer(object):
+
+    # lookahead: also place the next tetromino before choosing, starting
+    #   from the `width` best placements of the current one (all of them
+    #   if width is None).
+    def __init__(self, weights=None, lookahead=False, width=8):
+        self._weights   = dict(DEFAULT_WEIGHTS)
+        self._weights.update(weights or {})
+        self._lookahead = lookahead
+        self._width     = width
+        self._plan      = []
+        self._last      = None     # (pieces, x, direction, action) played last
+
+    def find_best(self, state, board):
+        # The best (rotations, shift, direction, x, y) for the current
+        # tetromino of a TetrisGame state on a Board of its size, or None
+        # if it cannot move.
+        grid = state['grid']
+        moving = Gtetrominoes[state['moving']]
+        x, y = state['pos']
+        placements = find_placements(board, grid, moving, state['direction'], x, y)
+        if not placements:
+            return None
+
+        grids, lines = [], []
+        for _, _, direction, col, row in placements:
+            new_grid, n = lock(board, grid, moving, direction, col, row)
+            grids.append(new_grid)
+            lines.append(n)
+        scores = score_grids(board, grids, lines, self._weights)
+        if not self._lookahead:
+            return placements[scores.index(max(scores))]
+
+        # Score every placement of the next tetromino on the grids left by
+        # the best placements of the current one, all in one batch, and
+        # keep the best pair.
+        candidates = sorted(range(len(grids)), key=scores.__getitem__,
+                            reverse=True)[:self._width]
+        nexting = Gtetrominoes[state['next']]
+        owners, next_grids, next_lines = [], [], []
+        for i in candidates:
+            for _, _, direction, col, row in find_placements(
+                    board, grids[i], nexting, 0, *board.spawn_pos):
+                next_grid, n = lock(board, grids[i], nexting, direction, col, row)
+                owners.append(i)
+                next_grids.append(next_grid)
+                next_lines.append(lines[i] + n)
+        if not next_grids:
+            return placements[scores.index(max(scores))]
+        scores = score_grids(board, next_grids, next_lines, self._weights)
+        return placements[owners[scores.index(max(scores))]]
+
+    def get_actions(self, game):
+        # The actions that play the best placement in a TetrisGame, hard
+        # drop included.
+        best = self.find_best(game.get_state(), game.get_board())
+        if best is None:
+            return [ACTION_HARD_DROP]
+        rotations, shift = best[0], best[1]
+        step = ACTION_LEFT if shift < 0 else ACTION_RIGHT
+        return [ACTION_ROTATE]*rotations + [step]*abs(shift) + [ACTION_HARD_DROP]
+
+    def next_action(self, game):
+        # One action of the current plan, planning again once the previous
+        # tetromino has been dropped. Used to play visibly, one action a frame.
+        # The plan is dropped too if the game is not where the last action
+        # should have left it: gravity locked the tetromino before the plan
+        # was played out, the game was restarted, or a player moved it.
+        state = game.get_state()
+        if self._plan and not self._is_on_plan(state):
+            self._plan = []
+        if not self._plan:
+            self._plan = self.get_actions(game)
+        action = self._plan.pop(0)
+        self._last = (state['pieces'], state['pos'][0], state['direction'], action)
+        return action
+
+    def _is_on_plan(self, state):
+        pieces, x, direction, action = self._last
+        if state['pieces'] != pieces:
+            return False
+        if action == ACTION_ROTATE:
+            # a kick can move it sideways
+            return state['direction'] == (direction+1) % 4
+        if action == ACTION_LEFT:
+            x -= 1
+        elif action == ACTION_RIGHT:
+            x += 1
+        return (state['pos'][0], state['direction']) == (x, direction)
+
+    def play(self, game):
+        # Places the current tetromino at once. Returns the events produced.
+        self._plan = []
+        events = []
+        for action in self.get_actions(game):
+            events.extend(game.step(action)[1])
+        return events
@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Plays many headless Tetris games across processes and reports how fast
+# the engine runs. Save the results of two commits with --output and diff
+# them to see whether a change made TetrisCore faster or slower.
+#
+#   python TetrisBench.py --games 64 --policy lookahead --output bench.json
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import random
+import time
+
+from TetrisCore import *
+from TetrisAI import Autoplayer
+
+# Policies place one tetromino of a TetrisGame, each by calling its
+# step()/perform() as often as it likes. They are made per game from the
+# game seed by the factories below.
+def make_autoplay_policy(seed):
+    return Autoplayer().play
+
+def make_lookahead_policy(seed):
+    return Autoplayer(lookahead=True).play
+
+def make_random_policy(seed):
+    rng = random.Random(seed)
+    actions = (ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_SOFT_DROP)
+    def policy(game):
+        for _ in range(rng.randint(0, 8)):
+            game.step(rng.choice(actions))
+        game.step(ACTION_HARD_DROP)
+    return policy
+
+Gpolicies = {
+    'autoplay'  : make_autoplay_policy,
+    'lookahead' : make_lookahead_policy,
+    'random'    : make_random_policy,
+}
+
+def get_policy_factory(name):
+    # A name from Gpolicies, or 'module:function' for a factory of your own.
+    if name in Gpolicies:
+        return Gpolicies[name]
+    module_name, sep, func_name = name.partition(':')
+    if not sep:
+        raise ValueError("unknown policy: {0!r}".format(name))
+    return getattr(importlib.import_module(module_name), func_name)
+
+def play_game(args):
+    policy_name, seed, max_pieces, rows, columns = args
+    policy = get_policy_factory(policy_name)(seed)
+    game = TetrisGame(seed, rows=rows, columns=columns)
+    game.pause()
+
+    start = time.perf_counter()
+    while not game.is_over() and game.get_state()['pieces'] < max_pieces:
+        policy(game)
+    seconds = time.perf_counter() - start
+
+    state = game.get_state()
+    return {
+        'seed'      : seed,
+        'pieces'    : state['pieces'],
+        'lines'     : state['lines'],
+        'score'     : state['score'],
+        'level'     : state['level'],
+        'game_over' : state['game_over'],
+        'win'       : state['win'],
+        'seconds'   : seconds,
+    }
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values)-1, int(p / 100.0 * len(values)))]
+
+def summarize(games, wall_seconds):
+    pieces = sum(game['pieces'] for game in games)
+    lines  = sum(game['lines'] for game in games)
+    scores = [game['score'] for game in games]
+    cpu_seconds = sum(game['seconds'] for game in games)
+    return {
+        'games'                  : len(games),
+        'wall_seconds'           : wall_seconds,
+        'cpu_seconds'            : cpu_seconds,
+        'pieces_per_second'      : pieces / wall_seconds,
+        'lines_per_second'       : lines / wall_seconds,
+        'pieces_per_cpu_second'  : pieces / cpu_seconds if cpu_seconds else 0.0,
+        'mean_pieces'            : pieces / float(len(games)),
+        'mean_lines'             : lines / float(len(games)),
+        'score' : {
+            'min'  : min(scores),
+            'p25'  : percentile(scores, 25),
+            'p50'  : percentile(scores, 50),
+            'p75'  : percentile(scores, 75),
+            'max'  : max(scores),
+            'mean' : sum(scores) / float(len(scores)),
+        },
+    }
+
+def run(policy, games, seed, processes, max_pieces, rows=ROWS, columns=COLUMNS):
+    jobs = [(policy, seed + i, max_pieces, rows, columns) for i in range(games)]
+    start = time.perf_counter()
+    if processes == 1:
+        results = [play_game(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(play_game, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    wall_seconds = time.perf_counter() - start
+    return {
+        'config' : {
+            'policy'     : policy,
+            'games'      : games,
+            'seed'       : seed,
+            'processes'  : processes,
+            'max_pieces' : max_pieces,
+            'rows'       : rows,
+            'columns'    : columns,
+        },
+        'summary' : summarize(results, wall_seconds),
+        'games'   : results,
+    }
+
+def print_summary(results):
+    summary = results['summary']
+    score = summary['score']
+    config = results['config']
+    print("{0} games of {1} on {2}x{3} in {4:.2f}s on {5} processes".format(
+        summary['games'], config['policy'], config['rows'], config['columns'],
+        summary['wall_seconds'], config['processes']))
+    print("{0:>12.1f} pieces/s".format(summary['pieces_per_second']))
+    print("{0:>12.1f} lines/s".format(summary['lines_per_second']))
+    print("{0:>12.1f} pieces/game".format(summary['mean_pieces']))
+    print("       score min {0} / p25 {1} / p50 {2} / p75 {3} / max {4}".format(
+        score['min'], score['p25'], score['p50'], score['p75'], score['max']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tetris self-play benchmark")
+    parser.add_argument('--games', type=int, default=32)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of the first game, the others count up")
+    parser.add_argument('--policy', default='autoplay',
+                        help="{0} or module:factory".format(
+                            ', '.join(sorted(Gpolicies))))
+    parser.add_argument('--max-pieces', type=int, default=1000,
+                        help="stop a game after this many tetrominoes")
+    parser.add_argument('--rows', type=int, default=ROWS)
+    parser.add_argument('--columns', type=int, default=COLUMNS)
+    parser.add_argument('--output', help="write the results as JSON here")
+    args = parser.parse_args(argv)
+
+    results = run(args.policy, args.games, args.seed, max(1, args.processes),
+                  args.max_pieces, args.rows, args.columns)
+    print_summary(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
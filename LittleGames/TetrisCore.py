@@ -0,0 +1,635 @@
+#! /usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# The rules of Tetris without any display. Tetris.py draws this game with
+# pygame, but nothing here needs SDL, so it can run in batch jobs.
+
+import random
+from collections import deque
+
+# game configuration
+ROWS      = 20      # default size of the board
+COLUMNS   = 10
+TICK_RATE = 60      # simulation steps per second
+MAX_TICKS = 15      # most steps run to catch up on one late frame
+
+# actions accepted by TetrisGame.step()
+ACTION_LEFT      = 'left'
+ACTION_RIGHT     = 'right'
+ACTION_ROTATE    = 'rotate'
+ACTION_SOFT_DROP = 'soft_drop'
+ACTION_HARD_DROP = 'hard_drop'
+ACTION_PAUSE     = 'pause'
+ACTION_RESTART   = 'restart'
+
+# events returned by TetrisGame.step(), as (event, value) pairs
+EVENT_LOCK      = 'lock'        # value: index of the locked tetromino
+EVENT_LINES     = 'lines'       # value: indices of the removed rows
+EVENT_LEVEL_UP  = 'level_up'    # value: the new level
+EVENT_WIN       = 'win'         # value: final score
+EVENT_GAME_OVER = 'game_over'   # value: final score
+
+# tetrominoes
+# Assuming all cells of a tetromino ard laid out on a
+# 4*4 grid, where each cell is either occupied or not.
+# And so that we can represent each tetromino as a si-
+# mple 16 bit integer. This idea come from
+# http://codeincomplete.com/posts/2011/10/10/javascript_tetris/
+Gtetrominoe_I = {
+    'blocks': (0x0F00, 0x2222, 0x00F0, 0x4444),
+}
+Gtetrominoe_J = {
+    'blocks': (0x8E00, 0x6440, 0x0E20, 0x44C0),
+}
+Gtetrominoe_L = {
+    'blocks': (0x2E00, 0x4460, 0x0E80, 0xC440),
+}
+Gtetrominoe_O = {
+    'blocks': (0x6600, 0x6600, 0x6600, 0x6600),
+}
+Gtetrominoe_S = {
+    'blocks': (0x6C00, 0x4620, 0x06C0, 0x8C40),
+}
+Gtetrominoe_T = {
+    'blocks': (0x4E00, 0x4640, 0x0E40, 0x4C40),
+}
+Gtetrominoe_Z = {
+    'blocks': (0xC600, 0x2640, 0x0C60, 0x4C80),
+}
+
+Gtetrominoes = (
+    Gtetrominoe_I,
+    Gtetrominoe_J,
+    Gtetrominoe_L,
+    Gtetrominoe_O,
+    Gtetrominoe_S,
+    Gtetrominoe_T,
+    Gtetrominoe_Z
+)
+
+# bitboard
+# Each row of the playfield is an integer whose bit (GRID_PAD + col) is
+# set when that cell is occupied. GRID_PAD bits of wall are kept on both
+# sides so that a tetromino row shifted into place can be tested against
+# the board with a single AND, walls included. The rows of a board of
+# any size are made by Board.
+GRID_PAD  = 4
+
+def block_to_rows(block):
+    # Split a 16 bit block into (row_offset, row_mask) pairs, skipping
+    # empty rows. Bit i of row_mask stands for column i of the 4*4 grid.
+    rows = []
+    for row in range(4):
+        nibble = (block >> (12 - row*4)) & 0xF
+        mask = 0
+        for col in range(4):
+            if nibble & (0x8 >> col):
+                mask |= 1 << col
+        if mask:
+            rows.append((row, mask))
+    return tuple(rows)
+
+def block_to_cells(block):
+    # (col, row) offsets of the occupied cells of a 16 bit block.
+    return tuple((bit % 4, bit // 4) for bit in range(16)
+                 if block & (0x8000 >> bit))
+
+def cells_to_bounds(cells):
+    # (min_col, max_col, bottom_row) of a tuple of cell offsets.
+    cols = [col for col, _ in cells]
+    return (min(cols), max(cols), max(row for _, row in cells))
+
+def cells_to_column_rows(cells, pick):
+    # (col, pick(rows)) for each column the cells cover, e.g. the top cell
+    # of every column with pick=min.
+    cols = sorted(set(col for col, _ in cells))
+    return tuple((col, pick(row for c, row in cells if c == col))
+                 for col in cols)
+
+# Lookup tables built once, indexed by direction like 'blocks':
+#   'rows'   --> bitboard row masks, for collision and locking
+#   'cells'  --> cell offsets, for drawing
+#   'bounds' --> bounding box, for the wall and floor checks
+#   'tops'   --> top cell of each column, for the column heights
+#   'bottoms'--> bottom cell of each column, for dropping on them
+for _index, _tetromino in enumerate(Gtetrominoes):
+    _tetromino['index'] = _index
+    _tetromino['rows'] = tuple(block_to_rows(b) for b in _tetromino['blocks'])
+    _tetromino['cells'] = tuple(block_to_cells(b) for b in _tetromino['blocks'])
+    _tetromino['bounds'] = tuple(cells_to_bounds(c) for c in _tetromino['cells'])
+    _tetromino['tops'] = tuple(cells_to_column_rows(c, min)
+                               for c in _tetromino['cells'])
+    _tetromino['bottoms'] = tuple(cells_to_column_rows(c, max)
+                                  for c in _tetromino['cells'])
+
+# Columns tried, in order, when a rotated tetromino does not fit.
+ROTATE_KICKS = (1, 2, -1, -2)
+
+# The size of a playfield, and the bitboard rows and checks that depend
+# on it. Boards of any size work the same; nothing here is O(rows) but
+# new_grid() and get_tops().
+class Board(object):
+
+    def __init__(self, rows=ROWS, columns=COLUMNS):
+        if rows < 4 or columns < 4:
+            raise ValueError("a board needs at least 4 rows and 4 columns")
+        wall = (1 << GRID_PAD) - 1
+        self.rows      = rows
+        self.columns   = columns
+        self.empty_row = wall | (wall << (GRID_PAD + columns))
+        self.full_row  = (1 << (columns + GRID_PAD*2)) - 1
+        self.spawn_pos = ((columns - 4) // 2, 0)
+
+    def new_grid(self):
+        return [self.empty_row] * self.rows
+
+    def fits(self, grid, tetromino, direction, x, y):
+        # Whether the tetromino at (x, y) is inside the board and only
+        # covers empty cells of grid.
+        min_col, max_col, bottom = tetromino['bounds'][direction]
+        if x + min_col < 0 or x + max_col >= self.columns or y + bottom >= self.rows:
+            return False
+        shift = x + GRID_PAD
+        for dy, mask in tetromino['rows'][direction]:
+            if grid[y+dy] & (mask << shift):
+                return False
+        return True
+
+    def landing_row(self, grid, tetromino, direction, x, y, tops=None):
+        # The row a tetromino at (x, y) stops on when dropped straight down.
+        # Given the top row of every column (see get_tops()), a tetromino
+        # above all of them lands in O(1); under an overhang it is dropped
+        # row by row.
+        if tops is not None:
+            landing = self.rows
+            for col, bottom in tetromino['bottoms'][direction]:
+                top = tops[x+col]
+                if y + bottom >= top:
+                    break
+                landing = min(landing, top - 1 - bottom)
+            else:
+                return landing
+        while self.fits(grid, tetromino, direction, x, y+1):
+            y += 1
+        return y
+
+    def get_tops(self, grid, start=0):
+        # The top occupied row of every column, self.rows for an empty
+        # column. Rows above start must be empty.
+        tops = [self.rows] * self.columns
+        pending = (1 << self.columns) - 1     # columns without a top yet
+        for row in range(start, self.rows):
+            bits = (grid[row] >> GRID_PAD) & pending
+            pending ^= bits
+            while bits:
+                low = bits & -bits
+                tops[low.bit_length() - 1] = row
+                bits ^= low
+            if not pending:
+                break
+        return tops
+
+# Deals tetrominoes from shuffled bags holding each of them four times.
+# Every game has its own generator, so games never share a bag, and a
+# game started with the same seed gets the same tetrominoes.
+class TetrominoGenerator(object):
+
+    _full_bag = tuple(i for i in range(7) for _ in range(4))
+
+    def __init__(self, seed=None, lookahead=1):
+        # lookahead is how many upcoming tetrominoes peek() can show.
+        self._random    = random.Random(seed)
+        self._lookahead = max(1, lookahead)
+        self._bag       = []
+        self._queue     = deque()
+        self._fill()
+
+    def next(self):
+        index = self._queue.popleft()
+        self._fill()
+        return Gtetrominoes[index]
+
+    def peek(self, count=1):
+        # The next count tetrominoes, without dealing them.
+        count = min(count, self._lookahead)
+        return [Gtetrominoes[self._queue[i]] for i in range(count)]
+
+    def snapshot(self):
+        return (self._random.getstate(), tuple(self._bag), tuple(self._queue))
+
+    def restore(self, snapshot):
+        random_state, bag, queue = snapshot
+        self._random.setstate(random_state)
+        self._bag   = list(bag)
+        self._queue = deque(queue)
+
+    def _fill(self):
+        while len(self._queue) < self._lookahead:
+            if not self._bag:
+                self._bag = list(self._full_bag)
+                self._random.shuffle(self._bag)
+            self._queue.append(self._bag.pop())
+
+# This class manages level and grade.
+class Level(object):
+
+    _top_level = 15
+    _lines_needed_per_level = 3
+    _scores = (100, 300, 500, 800)
+    _init_speed = 0.6
+    _fasted_speed = 0.05
+    _speed_increment = (_fasted_speed-_init_speed)/float((_top_level-1))
+
+    def __init__(self):
+        self._level = 1
+        self._goal  = 3
+        self._score = 0
+        self._speed = self._init_speed  # seconds needed to drop one row
+
+    def get_level(self):
+        return self._level
+
+    def get_goal(self):
+        return self._goal
+
+    def get_speed(self):
+        return self._speed
+
+    def get_score(self):
+        return self._score
+
+    def add_score(self, score):
+        self._score += score
+
+    # used to add score according to lines removed
+    #   and to check if the player wins.
+    # score = self._scores[removed_lines-1] * (self._level*0.5 + 0.5)
+    def remove_lines(self, removed_lines):
+        score = self._scores[removed_lines-1] * (self._level*0.5 + 0.5)
+        self.add_score(int(score))
+        self._goal -= removed_lines
+        if self._goal <= 0:
+            return self._level_up()
+        return False
+
+    def _level_up(self):
+        self._level += 1
+        if self._level == self._top_level + 1:
+            return True
+        self._goal = self._level * self._lines_needed_per_level
+        self._speed += self._speed_increment
+        return False
+
+# The rules of the game: piece queue, movement, gravity, scoring and
+# the win/game over checks. Drive it with step(action, dt), or call the
+# movement methods directly as the pygame front end does.
+class TetrisGame(object):
+
+    # seed and lookahead are passed to the TetrominoGenerator. Restarting
+    # keeps dealing from the same generator. rows and columns give the
+    # size of the board.
+    def __init__(self, seed=None, lookahead=1, rows=ROWS, columns=COLUMNS):
+        self._board     = Board(rows, columns)
+        self._generator = TetrominoGenerator(seed, lookahead)
+        self._reset()
+
+    def _reset(self):
+        self._grid           = self._board.new_grid()
+        self._tops           = [self._board.rows] * self._board.columns
+        self._stack_top      = self._board.rows  # no locked cell above it
+        self._curr_pos       = list(self._board.spawn_pos)
+        self._direction      = 0
+        self._moving         = self._generator.next()
+        self._next           = self._generator.next()
+        self._time           = 0.0
+        self._level          = self._new_level()
+        self._is_pause       = True
+        self._is_win         = False
+        self._is_game_over   = False
+        self._events         = []
+        self._pieces         = 0     # tetrominoes locked so far
+        self._lines          = 0     # lines removed so far
+        self._board_version  = 0     # bumped whenever locked cells change
+        self._ghost_key      = None  # what _ghost_row was computed for
+        self._ghost_row      = 0
+        self._grid_version   = None  # what _grid_tuple was copied at
+        self._grid_tuple     = ()
+
+    def _new_level(self):
+        return Level()
+
+    def get_board(self):
+        return self._board
+
+    def get_generator(self):
+        return self._generator
+
+    def get_grid(self):
+        # The locked rows as a tuple, only copied again once they change.
+        if self._grid_version != self._board_version:
+            self._grid_version = self._board_version
+            self._grid_tuple = tuple(self._grid)
+        return self._grid_tuple
+
+    def get_stack_top(self):
+        # No row above this one has a locked cell.
+        return self._stack_top
+
+    def set_time(self, time_passed_seconds):
+        self._time += time_passed_seconds
+
+    def get_speed(self):
+        return self._level.get_speed()
+
+    def get_score(self):
+        return self._level.get_score()
+
+    def is_pause(self):
+        return self._is_pause
+
+    def pause(self):
+        self._is_pause = not self._is_pause
+
+    def is_game_over(self):
+        return self._is_game_over
+
+    def is_win(self):
+        return self._is_win
+
+    def is_over(self):
+        return self._is_win or self._is_game_over
+
+    def restart(self):
+        self._reset()
+
+    def step(self, action=None, dt=0.0):
+        # Apply one action (or None), then let gravity run for dt seconds.
+        # Returns the state after the step and the events it produced.
+        if action is not None:
+            self.perform(action)
+        if not (self._is_pause or self.is_over()):
+            self.set_time(dt)
+            self.drop_freely()
+        events, self._events = self._events, []
+        return self.get_state(), events
+
+    def perform(self, action):
+        handler = self._action_handlers.get(action, None)
+        if handler is None:
+            raise ValueError("unknown action: {0!r}".format(action))
+        # Only pausing and restarting make sense on a stopped game.
+        if action in (ACTION_PAUSE, ACTION_RESTART) or not (
+                self._is_pause or self.is_over()):
+            handler(self)
+
+    def get_state(self):
+        return {
+            'grid'      : self.get_grid(),
+            'pos'       : tuple(self._curr_pos),
+            'direction' : self._direction,
+            'moving'    : self._moving['index'],
+            'next'      : self._next['index'],
+            'level'     : self._level.get_level(),
+            'goal'      : self._level.get_goal(),
+            'score'     : self._level.get_score(),
+            'pieces'    : self._pieces,
+            'lines'     : self._lines,
+            'pause'     : self._is_pause,
+            'win'       : self._is_win,
+            'game_over' : self._is_game_over,
+        }
+
+    def remove_lines(self):
+        removed_rows = self._check_lines(self._update_curr_tetromino())
+        removed_lines = len(removed_rows)
+        if removed_lines > 0:
+            self._lines += removed_lines
+            level = self._level.get_level()
+            self._is_win = self._level.remove_lines(removed_lines)
+            self._events.append((EVENT_LINES, removed_rows))
+            if self._is_win:
+                self._events.append((EVENT_WIN, self.get_score()))
+            elif self._level.get_level() != level:
+                self._events.append((EVENT_LEVEL_UP, self._level.get_level()))
+        return removed_lines
+
+    def drop_freely(self):
+        if (self._time > self.get_speed()):
+            self._time -= self.get_speed()
+            self._drop()
+
+    def softland(self):
+        y = self._curr_pos[1]
+        is_unoccupied = self.move('down')
+        self._add_score(self._curr_pos[1]-y)
+        if not is_unoccupied:
+            self.remove_lines()
+
+    def hardland(self):
+        y = self._curr_pos[1]
+        self._curr_pos[1] = self.get_ghost_row()
+        self._add_score((self._curr_pos[1]-y)*2)
+        self.remove_lines()
+
+    def get_ghost_row(self):
+        # The row the current tetromino would land on. Moving down does not
+        # change it, so it is only recomputed after a move to another column,
+        # a rotation, a new tetromino or a change of the locked cells.
+        x, y = self._curr_pos
+        key = (self._moving['index'], self._direction, x, self._board_version)
+        if key != self._ghost_key:
+            self._ghost_key = key
+            self._ghost_row = self._board.landing_row(
+                self._grid, self._moving, self._direction, x, y, self._tops)
+        return self._ghost_row
+
+    def move(self, direction):
+        x, y = self._curr_pos
+        if direction == 'left':
+            x -= 1
+        elif direction == 'right':
+            x += 1
+        elif direction == 'down':
+            y += 1
+        else:
+            raise ValueError("direction must be 'left', 'right' or 'down'")
+
+        if self.is_unoccupied((x, y)):
+            self._curr_pos[0] = x
+            self._curr_pos[1] = y
+            return True
+        return False
+
+    def rotate(self):
+        old_direction = self._direction
+        old_pos = self._curr_pos[:]
+
+        self._direction = (self._direction+1) % 4
+        if not self.is_unoccupied(self._curr_pos):
+
+            for i in ROTATE_KICKS:
+                self._curr_pos[0] += i
+                if self.is_unoccupied(self._curr_pos):
+                    return
+                self._curr_pos[0] -= i
+
+            self._direction = old_direction
+            self._curr_pos = old_pos
+
+    def is_unoccupied(self, pos):
+        return self._board.fits(self._grid, self._moving, self._direction,
+                                pos[0], pos[1])
+
+    def _add_curr_tetromino(self):
+        # Returns the rows the tetromino was added to.
+        x, y = self._curr_pos
+        shift = x + GRID_PAD
+        rows = []
+        for dy, mask in self._moving['rows'][self._direction]:
+            self._grid[y+dy] |= mask << shift
+            rows.append(y+dy)
+        for col, row in self._moving['tops'][self._direction]:
+            if y + row < self._tops[x+col]:
+                self._tops[x+col] = y + row
+        self._stack_top = min(self._stack_top, rows[0])
+        self._board_version += 1
+        return rows
+
+    def _add_score(self, score):
+        self._level.add_score(score)
+
+    def _drop(self):
+        if not self.move('down'):
+            self.remove_lines()
+
+    def _check_lines(self, rows):
+        # Only the rows just filled can be full. The full ones are removed
+        # and the stack above them moved down in a single pass, leaving
+        # empty rows at the top. Returns the indices of the removed rows,
+        # bottom up.
+        # This is not quite what the old loop did: it copied row 0 down into
+        # row 1 on every line cleared and left row 0 as it was, so cells
+        # locked in row 0 were duplicated, and it cleared a full row 0
+        # without counting it.
+        grid = self._grid
+        full_row = self._board.full_row
+        removed_rows = tuple(row for row in sorted(rows, reverse=True)
+                             if grid[row] == full_row)
+        if removed_rows:
+            top = self._stack_top
+            dest = removed_rows[0]
+            for row in range(dest, top-1, -1):
+                if grid[row] != full_row:
+                    grid[dest] = grid[row]
+                    dest -= 1
+            for row in range(top, dest+1):
+                grid[row] = self._board.empty_row
+            self._stack_top = dest + 1
+            self._tops = self._board.get_tops(grid, self._stack_top)
+            self._board_version += 1
+        return removed_rows
+
+    def _update_curr_tetromino(self):
+        # Returns the rows the tetromino was locked into.
+        rows = self._add_curr_tetromino()
+        self._pieces += 1
+        self._events.append((EVENT_LOCK, self._moving['index']))
+        self._moving = self._next
+        self._next = self._generator.next()
+        self._curr_pos = list(self._board.spawn_pos)
+        self._direction = 0
+        if not self.is_unoccupied(self._curr_pos):
+            self._is_game_over = True
+            self._events.append((EVENT_GAME_OVER, self.get_score()))
+        return rows
+
+    _action_handlers = {
+        ACTION_LEFT      : lambda game: game.move('left'),
+        ACTION_RIGHT     : lambda game: game.move('right'),
+        ACTION_ROTATE    : lambda game: game.rotate(),
+        ACTION_SOFT_DROP : lambda game: game.softland(),
+        ACTION_HARD_DROP : lambda game: game.hardland(),
+        ACTION_PAUSE     : lambda game: game.pause(),
+        ACTION_RESTART   : lambda game: game.restart(),
+    }
+
+# Runs a TetrisGame in fixed steps of 1/tick_rate seconds, however long
+# the frames in between take. Actions are queued with the simulation time
+# they happened at and played on the step that covers that time, before
+# its gravity. Gravity therefore no longer depends on the frame rate or
+# on whether a key was pressed during the frame.
+class Simulation(object):
+
+    # speed scales the time given to advance(), e.g. 4 plays four times
+    # faster. No step after stop_tick is run, if it is given. recorder, if
+    # given, is told record(tick, action) for every action played, e.g. a
+    # TetrisReplay.Recorder.
+    def __init__(self, game, tick_rate=TICK_RATE, max_ticks=MAX_TICKS,
+                 speed=1.0, stop_tick=None, recorder=None):
+        self._game        = game
+        self._recorder    = recorder
+        self._tick        = 1.0 / tick_rate
+        self._max_ticks   = max(1, int(max_ticks * speed))
+        self._speed       = speed
+        self._stop_tick   = stop_tick
+        self._ticks       = 0       # steps run so far
+        self._accumulator = 0.0     # time not yet simulated
+        self._actions     = deque() # (time, action), oldest first
+
+    def get_game(self):
+        return self._game
+
+    def get_ticks(self):
+        return self._ticks
+
+    def get_time(self):
+        # Simulation time, in seconds, of the last step run.
+        return self._ticks * self._tick
+
+    def get_alpha(self):
+        # How far between the last step and the next one the present is,
+        # from 0 to 1, for renderers that interpolate.
+        return self._accumulator / self._tick
+
+    def has_pending(self):
+        return bool(self._actions)
+
+    def queue(self, action, time=None):
+        # time defaults to now: the action is played on the next step.
+        if time is None:
+            time = self.get_time() + self._accumulator
+        self._actions.append((time, action))
+
+    def queue_at(self, tick, action):
+        # Queues an action to be played on the given step.
+        self.queue(action, tick * self._tick)
+
+    def advance(self, seconds):
+        # Runs every step due after `seconds` more of real time, at most
+        # max_ticks (times speed) of them; the rest of a very late frame is
+        # dropped so that the game slows down rather than freezing. Returns
+        # the events.
+        self._accumulator += seconds * self._speed
+        # the epsilon keeps float error from losing a step now and then
+        ticks = int(self._accumulator / self._tick + 1e-9)
+        if ticks > self._max_ticks:
+            ticks = self._max_ticks
+            self._accumulator = ticks * self._tick
+        self._accumulator = max(0.0, self._accumulator - ticks * self._tick)
+        return self.run(ticks)
+
+    def run(self, ticks):
+        # Runs `ticks` steps right away, e.g. to play headless unthrottled.
+        if self._stop_tick is not None:
+            ticks = max(0, min(ticks, self._stop_tick - self._ticks))
+        events = []
+        for _ in range(ticks):
+            self._ticks += 1
+            now = self.get_time()
+            while self._actions and self._actions[0][0] <= now:
+                action = self._actions.popleft()[1]
+                if self._recorder is not None:
+                    self._recorder.record(self._ticks, action)
+                events.extend(self._game.step(action)[1])
+            events.extend(self._game.step(None, self._tick)[1])
+        return events
@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Recording and replaying Tetris games. A game is fully determined by the
+# size of its board, the seed of its TetrominoGenerator, the tick rate of
+# its Simulation and the step each action was played on, so that is all a
+# replay stores:
+#
+#   header  --> magic, version, tick rate, seed      (struct '<4sBHq')
+#               rows, columns                        (struct '<HH')
+#   records --> step, action code                    (struct '<IB')
+#   end     --> last step, END_CODE                  (struct '<IB')
+#
+# Run this module to replay logs headless as fast as possible, e.g. as a
+# fixed workload when measuring the speed of the engine:
+#
+#   python TetrisReplay.py game.replay --repeat 20
+
+import argparse
+import struct
+import time
+
+from TetrisCore import *
+
+REPLAY_MAGIC   = b'TTRP'
+REPLAY_VERSION = 2     # version 1 had no board size, it was always 20*10
+END_CODE       = 0xFF
+
+Gheader_struct = struct.Struct('<4sBHq')
+Gboard_struct  = struct.Struct('<HH')
+Grecord_struct = struct.Struct('<IB')
+
+Gaction_codes = {
+    ACTION_LEFT      : 1,
+    ACTION_RIGHT     : 2,
+    ACTION_ROTATE    : 3,
+    ACTION_SOFT_DROP : 4,
+    ACTION_HARD_DROP : 5,
+    ACTION_PAUSE     : 6,
+    ACTION_RESTART   : 7,
+}
+Gcode_actions = dict((code, action) for action, code in Gaction_codes.items())
+
+# Pass one as the recorder of a Simulation to write its actions to a file.
+class Recorder(object):
+
+    def __init__(self, path, seed, tick_rate=TICK_RATE, rows=ROWS, columns=COLUMNS):
+        self._file = open(path, 'wb')
+        self._file.write(Gheader_struct.pack(
+            REPLAY_MAGIC, REPLAY_VERSION, tick_rate, seed))
+        self._file.write(Gboard_struct.pack(rows, columns))
+        self._last_tick = 0
+
+    def record(self, tick, action):
+        self._file.write(Grecord_struct.pack(tick, Gaction_codes[action]))
+        self._last_tick = tick
+
+    def close(self, tick=None):
+        # tick is the last step run, so that a replay also plays the
+        # gravity after the last action.
+        if self._file.closed:
+            return
+        if tick is None:
+            tick = self._last_tick
+        self._file.write(Grecord_struct.pack(tick, END_CODE))
+        self._file.close()
+
+class Replay(object):
+
+    def __init__(self, seed, tick_rate, actions, end_tick,
+                 rows=ROWS, columns=COLUMNS):
+        self.seed      = seed
+        self.tick_rate = tick_rate
+        self.rows      = rows
+        self.columns   = columns
+        self.actions   = actions    # (tick, action), in the order played
+        self.end_tick  = end_tick
+
+    def make_simulation(self, game=None, **kwargs):
+        # A Simulation stopping at the end of the replay, with every action
+        # of the replay queued. game must be new and use the replay seed and
+        # board size, it defaults to a TetrisGame. kwargs go to Simulation,
+        # e.g. speed.
+        if game is None:
+            game = TetrisGame(self.seed, rows=self.rows, columns=self.columns)
+        simulation = Simulation(game, self.tick_rate,
+                                stop_tick=self.end_tick, **kwargs)
+        for tick, action in self.actions:
+            simulation.queue_at(tick, action)
+        return simulation
+
+def read_replay(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, tick_rate, seed = Gheader_struct.unpack_from(data, 0)
+    if magic != REPLAY_MAGIC or version not in (1, REPLAY_VERSION):
+        raise ValueError("{0} is not a Tetris replay".format(path))
+    start = Gheader_struct.size
+    rows, columns = ROWS, COLUMNS
+    if version >= 2:
+        rows, columns = Gboard_struct.unpack_from(data, start)
+        start += Gboard_struct.size
+    actions = []
+    end_tick = 0
+    # A log cut short, e.g. by a crash, simply has no end record.
+    usable = len(data) - (len(data) - start) % Grecord_struct.size
+    for offset in range(start, usable, Grecord_struct.size):
+        tick, code = Grecord_struct.unpack_from(data, offset)
+        end_tick = max(end_tick, tick)
+        if code == END_CODE:
+            break
+        actions.append((tick, Gcode_actions[code]))
+    return Replay(seed, tick_rate, actions, end_tick, rows, columns)
+
+def play_headless(replay):
+    # Plays a replay as fast as possible. Returns the final game state.
+    simulation = replay.make_simulation()
+    simulation.run(replay.end_tick)
+    return simulation.get_game().get_state()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay Tetris games headless")
+    parser.add_argument('replays', nargs='+')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="play every replay this many times")
+    args = parser.parse_args(argv)
+
+    for path in args.replays:
+        replay = read_replay(path)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            state = play_headless(replay)
+        seconds = time.perf_counter() - start
+        print("{0}: {1}x{2}, score {3}, {4} lines, {5} pieces, {6} steps".format(
+            path, replay.rows, replay.columns, state['score'], state['lines'],
+            state['pieces'], replay.end_tick))
+        print("    {0:.1f} steps/s over {1} runs".format(
+            replay.end_tick * args.repeat / seconds, args.repeat))
+
+if __name__ == '__main__':
+    main()
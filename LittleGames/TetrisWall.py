@@ -0,0 +1,254 @@
+#! /usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Many Tetris games in one window, scaled down and tiled, e.g. for a wall
+# display. Every game is a TetrisManager drawing into a surface of its
+# own, played by an autoplayer or by a replay:
+#
+#   python TetrisWall.py --games 36
+#   python TetrisWall.py game1.replay game2.replay --speed 2
+
+import argparse
+import math
+import random
+
+import pygame
+from pygame.locals import *
+
+from Tetris import *
+
+# wall configuration
+WALL_FPS      = 30
+WALL_WIDTH    = 1280
+WALL_HEIGHT   = 720
+TILE_GAP      = 4         # pixels between two tiles
+RESTART_DELAY = 3.0       # seconds a finished autoplayed game stays shown
+
+WALL_BACKGROUND_COLOR = (20, 20, 20)
+
+# One game of the wall. Its manager draws into a surface of the size of
+# its Layout, and only what draw_dirty() or one of the text screens changed
+# is scaled down onto the window. Tiles are shrunk by a whole factor, so
+# that every block of factor*factor pixels of the surface becomes exactly
+# one pixel of the window and changed blocks can be scaled on their own.
+class Tile(object):
+
+    # simulation drives a TetrisManager drawing on surface. restart: start
+    # a finished game again after RESTART_DELAY, for autoplayed games.
+    def __init__(self, simulation, surface, background, restart=False):
+        self._simulation = simulation
+        self._manager    = simulation.get_game()
+        self._surface    = surface
+        self._background = background
+        self._restart    = restart
+        self._rect       = None     # where the tile goes on the window
+        self._factor     = 1        # how many times smaller it is shown
+        self._shown      = None     # the text screen being shown, if any
+        self._over_time  = 0.0      # seconds the game has been over
+        self._stale      = True     # whether the window shows an old tile
+
+    def get_manager(self):
+        return self._manager
+
+    def get_size(self):
+        return self._surface.get_size()
+
+    def place(self, cell):
+        # Fits the tile in a cell of the window, keeping its aspect ratio.
+        width, height = self._surface.get_size()
+        scale = min(cell.width / float(width), cell.height / float(height))
+        self._factor = max(1, int(math.ceil(1 / scale - 1e-9)))
+        self._rect = pygame.Rect(0, 0, width // self._factor,
+                                 height // self._factor)
+        self._rect.center = cell.center
+        self._stale = True
+
+    def update(self, seconds):
+        simulation, manager = self._simulation, self._manager
+        if not simulation.has_pending():
+            action = manager.get_autoplay_action()
+            if action is not None:
+                simulation.queue(action)
+        simulation.advance(seconds)
+        if self._restart and manager.is_over():
+            self._over_time += seconds
+            if self._over_time >= RESTART_DELAY:
+                self._over_time = 0.0
+                simulation.queue(ACTION_RESTART)
+                simulation.queue(ACTION_PAUSE)
+
+    def draw(self, window):
+        # Redraws what changed in the game of the tile. Returns the rects of
+        # the window to update.
+        manager = self._manager
+        if manager.is_pause():
+            text_screen = manager.draw_pause
+        elif manager.is_win():
+            text_screen = manager.win
+        elif manager.is_game_over():
+            text_screen = manager.game_over
+        else:
+            text_screen = None
+
+        dirty = []
+        if text_screen is None:
+            self._shown = None
+            dirty = manager.draw_dirty(self._background)
+        elif text_screen != self._shown:
+            self._shown = text_screen
+            text_screen()
+            self._stale = True
+
+        if self._stale:
+            self._stale = False
+            dirty = [self._surface.get_rect()]
+        else:
+            dirty = merge_rects(dirty)
+        return [self._scale_rect(window, rect) for rect in dirty]
+
+    def _scale_rect(self, window, rect):
+        # Scales the blocks of the surface covering rect onto the window.
+        # Returns the rect of the window updated.
+        factor = self._factor
+        # the blocks covering rect, leaving out the pixels of the surface
+        # past the last whole block
+        rect = rect.clip(self._surface.get_rect())
+        left, top = rect.left // factor, rect.top // factor
+        right  = min(self._rect.width, -(-rect.right // factor))
+        bottom = min(self._rect.height, -(-rect.bottom // factor))
+        dest = pygame.Rect(self._rect.left + left, self._rect.top + top,
+                           right - left, bottom - top)
+        if dest.width > 0 and dest.height > 0:
+            source = self._surface.subsurface(
+                (left*factor, top*factor, dest.width*factor, dest.height*factor))
+            if factor == 1:
+                window.blit(source, dest)
+            else:
+                pygame.transform.smoothscale(source, dest.size,
+                                             window.subsurface(dest))
+        return dest
+
+# Scaling many small rects costs more than scaling a few more pixels, so
+# rects touching each other (the cells of a tetromino, the tetromino before
+# and after a move) are merged into one.
+def merge_rects(rects):
+    merged = []
+    for rect in rects:
+        rect = rect.inflate(CELL_SIZE, CELL_SIZE)
+        for i, other in enumerate(merged):
+            if other.colliderect(rect):
+                merged[i] = other.union(rect)
+                break
+        else:
+            merged.append(rect)
+    return merged
+
+# The cells of a grid of `count` tiles of tile_size filling the window
+# best, row by row.
+def tile_cells(count, tile_size, window_size):
+    tile_width, tile_height = tile_size
+    width, height = window_size
+    best, best_scale = 1, 0.0
+    for columns in range(1, count + 1):
+        rows = int(math.ceil(count / float(columns)))
+        cell_width  = (width - TILE_GAP*(columns+1)) / float(columns)
+        cell_height = (height - TILE_GAP*(rows+1)) / float(rows)
+        scale = min(cell_width / tile_width, cell_height / tile_height)
+        if scale > best_scale:
+            best, best_scale = columns, scale
+    columns = best
+    rows = int(math.ceil(count / float(columns)))
+    cell_width  = (width - TILE_GAP*(columns+1)) // columns
+    cell_height = (height - TILE_GAP*(rows+1)) // rows
+    return [pygame.Rect(TILE_GAP + (i % columns)*(cell_width + TILE_GAP),
+                        TILE_GAP + (i // columns)*(cell_height + TILE_GAP),
+                        cell_width, cell_height)
+            for i in range(count)]
+
+# Tiles of the same size share their background.
+Gbackgrounds = {}
+
+def make_tile(font, simulation_factory, seed, rows, columns, restart):
+    # simulation_factory(manager) returns the Simulation driving manager.
+    layout = Layout(rows, columns)
+    surface = pygame.Surface(layout.get_screen_size()).convert()
+    key = (rows, columns)
+    if key not in Gbackgrounds:
+        Gbackgrounds[key] = make_background(surface, font, layout)
+    manager = TetrisManager(surface, font, seed, rows, columns)
+    return Tile(simulation_factory(manager), surface, Gbackgrounds[key], restart)
+
+def make_autoplay_tile(font, seed, rows, columns, lookahead=False):
+    def simulation_factory(manager):
+        manager.toggle_autoplay(lookahead)
+        simulation = Simulation(manager)
+        simulation.queue(ACTION_PAUSE)
+        return simulation
+    return make_tile(font, simulation_factory, seed, rows, columns, True)
+
+def make_replay_tile(font, replay, speed=1.0):
+    def simulation_factory(manager):
+        return replay.make_simulation(manager, speed=speed)
+    return make_tile(font, simulation_factory, replay.seed,
+                     replay.rows, replay.columns, False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch many Tetris games")
+    parser.add_argument('replays', nargs='*',
+                        help="replays to watch, autoplayed games if none")
+    parser.add_argument('--games', type=int, default=16,
+                        help="how many autoplayed games to watch")
+    parser.add_argument('--seed', type=int,
+                        help="seed of the first game, the others count up")
+    parser.add_argument('--lookahead', action='store_true',
+                        help="let the autoplayers look at the next tetromino")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="how many times faster to play the replays")
+    parser.add_argument('--rows', type=int, default=ROWS)
+    parser.add_argument('--columns', type=int, default=COLUMNS)
+    parser.add_argument('--width', type=int, default=WALL_WIDTH)
+    parser.add_argument('--height', type=int, default=WALL_HEIGHT)
+    args = parser.parse_args(argv)
+
+    pygame.display.init()
+    pygame.font.init()
+    window = pygame.display.set_mode((args.width, args.height), 0, 32)
+    clock  = pygame.time.Clock()
+    font   = get_sys_font(int(1.3*CELL_SIZE), False, True)
+
+    if args.replays:
+        tiles = [make_replay_tile(font, read_replay(path), args.speed)
+                 for path in args.replays]
+    else:
+        seed = args.seed
+        if seed is None:
+            seed = random.randrange(2**31)
+        tiles = [make_autoplay_tile(font, seed + i, args.rows, args.columns,
+                                    args.lookahead)
+                 for i in range(args.games)]
+    # the cells fit the biggest tile, smaller ones are centered in theirs
+    tile_size = (max(tile.get_size()[0] for tile in tiles),
+                 max(tile.get_size()[1] for tile in tiles))
+    for tile, cell in zip(tiles, tile_cells(len(tiles), tile_size,
+                                            window.get_size())):
+        tile.place(cell)
+    window.fill(WALL_BACKGROUND_COLOR)
+    pygame.display.update()
+
+    while True:
+        time_passed_seconds = clock.tick(WALL_FPS)/1000.
+        pygame.display.set_caption("Tetris wall    FPS: %.2f" % clock.get_fps())
+        for event in pygame.event.get():
+            if event.type == QUIT or (
+                    event.type == KEYDOWN and event.key == K_ESCAPE):
+                pygame.quit()
+                return
+        dirty = []
+        for tile in tiles:
+            tile.update(time_passed_seconds)
+            dirty.extend(tile.draw(window))
+        if dirty:
+            pygame.display.update(dirty)
+
+if __name__ == '__main__':
+    main()
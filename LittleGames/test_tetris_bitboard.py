@@ -0,0 +1,251 @@
+#! /usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Checks that the bitboard engine of TetrisCore.TetrisGame plays exactly
+# like the list-of-lists TetrisManager it replaced. ReferenceTetris below
+# is that old logic, pygame taken out; both games are dealt the same
+# tetrominoes and given the same actions, and are compared after every
+# action:
+#
+#   python -m unittest test_tetris_bitboard
+
+import random
+import unittest
+
+from TetrisCore import *
+from TetrisAI import Autoplayer
+
+GAMES      = 20       # seeds played by each test
+MAX_PIECES = 2000     # a game is stopped after this many tetrominoes
+
+# The old rules, with a grid of rows of None/True and a callback for every
+# cell of a tetromino. The one change is in _check_lines: the old loop
+# copied row 0 down into row 1 and left row 0 as it was, which duplicated
+# whatever was locked in it, and never removed a full row 0. Both were
+# fixed with the single-pass compaction, and are fixed here too.
+class ReferenceTetris(object):
+
+    _init_moving_pos = [3, 0]
+
+    def __init__(self, seed):
+        self._generator    = TetrominoGenerator(seed)
+        self._grid         = [ [None]*COLUMNS for _ in range(ROWS) ]
+        self._curr_pos     = self._init_moving_pos[:]
+        self._direction    = 0
+        self._moving       = self._generator.next()
+        self._next         = self._generator.next()
+        self._time         = 0.0
+        self._level        = Level()
+        self._is_win       = False
+        self._is_game_over = False
+
+    def get_state(self):
+        return {
+            'grid'      : [[bool(cell) for cell in row] for row in self._grid],
+            'pos'       : tuple(self._curr_pos),
+            'direction' : self._direction,
+            'moving'    : self._moving['index'],
+            'score'     : self._level.get_score(),
+            'win'       : self._is_win,
+            'game_over' : self._is_game_over,
+        }
+
+    def set_time(self, time_passed_seconds):
+        self._time += time_passed_seconds
+
+    def get_speed(self):
+        return self._level.get_speed()
+
+    def remove_lines(self):
+        self._update_curr_tetromino()
+        removed_lines = self._check_lines()
+        if removed_lines > 0:
+            self._is_win = self._level.remove_lines(removed_lines)
+        return removed_lines
+
+    def drop_freely(self):
+        if (self._time > self.get_speed()):
+            self._time -= self.get_speed()
+            self._drop()
+
+    def softland(self):
+        y = self._curr_pos[1]
+        is_unoccupied = self.move('down')
+        self._add_score(self._curr_pos[1]-y)
+        if not is_unoccupied:
+            self.remove_lines()
+
+    def hardland(self):
+        y = self._curr_pos[1]
+        while self.move('down'):
+            pass
+        self._add_score((self._curr_pos[1]-y)*2)
+        self.remove_lines()
+
+    def move(self, direction):
+        x, y = self._curr_pos
+        if direction == 'left':
+            x -= 1
+        elif direction == 'right':
+            x += 1
+        elif direction == 'down':
+            y += 1
+        else:
+            raise ValueError("direction must be 'left', 'right' or 'down'")
+
+        if self.is_unoccupied((x, y)):
+            self._curr_pos[0] = x
+            self._curr_pos[1] = y
+            return True
+        return False
+
+    def rotate(self):
+        old_direction = self._direction
+        old_pos = self._curr_pos[:]
+
+        self._direction = (self._direction+1) % 4
+        if not self.is_unoccupied(self._curr_pos):
+
+            for i in (1, 2, -1, -2):
+                self._curr_pos[0] += i
+                if self.is_unoccupied(self._curr_pos):
+                    return
+                self._curr_pos[0] -= i
+
+            self._direction = old_direction
+            self._curr_pos = old_pos
+
+    def is_unoccupied(self, pos):
+        result = []
+        map_to_each_cell(self._moving, pos,
+            self._direction, self._is_cell_unoccupied, result)
+        return all(result)
+
+    def _is_cell_unoccupied(self, x, y, result):
+        if (0 <= x < COLUMNS) and (0 <= y < ROWS) and self._get_block(x, y):
+            result.append(True)
+        else:
+            result.append(False)
+
+    def _get_block(self, x, y):
+        if self._grid[y][x] == None:
+            return True
+        else: return False
+
+    def _add_a_cell(self, x, y, aux_data=None):
+        self._grid[y][x] = True
+
+    def _add_curr_tetromino(self):
+        map_to_each_cell(self._moving, self._curr_pos, self._direction,
+            self._add_a_cell)
+
+    def _add_score(self, score):
+        self._level.add_score(score)
+
+    def _drop(self):
+        if not self.move('down'):
+            self.remove_lines()
+
+    def _check_lines(self):
+        removed_lines = 0
+        row = ROWS - 1
+        while row >= 0:
+            if all(self._grid[row]):
+                for i in reversed(range(1, row+1)):
+                    self._grid[i] = self._grid[i-1][:]
+                self._grid[0] = [None] * COLUMNS
+                row += 1        # check this line again since it was changed
+                removed_lines += 1
+            row -= 1
+        return removed_lines
+
+    def _update_curr_tetromino(self):
+        self._add_curr_tetromino()
+        self._moving = self._next
+        self._next = self._generator.next()
+        self._curr_pos = self._init_moving_pos[:]
+        self._direction = 0
+        if not self.is_unoccupied(self._curr_pos):
+            self._is_game_over = True
+
+def map_to_each_cell(tetromino, grid_pos, direction, map_fn, aux_data=None):
+    # map_fn must have the form --> map_fn(grid_x, grid_y, aux_data)
+    # where grid_x and grid_y denotes the position of a cell of tetromino
+    bit   = 0x8000
+    block = tetromino['blocks'][direction]
+    col, row = 0, 0
+    grid_x, grid_y = grid_pos
+    while bit > 0:
+        if block & bit:
+            map_fn(grid_x+col, grid_y+row, aux_data)
+        col += 1
+        bit >>= 1
+        if (col == 4):
+            col = 0
+            row += 1
+
+def grid_to_cells(grid):
+    # The bitboard rows of a TetrisGame as rows of booleans.
+    return [[bool(row & (1 << (GRID_PAD + col))) for col in range(COLUMNS)]
+            for row in grid]
+
+def drop(game):
+    # One row of gravity.
+    game.set_time(game.get_speed() + 0.01)
+    game.drop_freely()
+
+Gactions = {
+    ACTION_LEFT      : lambda game: game.move('left'),
+    ACTION_RIGHT     : lambda game: game.move('right'),
+    ACTION_ROTATE    : lambda game: game.rotate(),
+    ACTION_SOFT_DROP : lambda game: game.softland(),
+    ACTION_HARD_DROP : lambda game: game.hardland(),
+    'drop'           : drop,
+}
+
+class BitboardTest(unittest.TestCase):
+
+    def play(self, seed, noise):
+        # Plays both engines with the actions of an autoplayer, replacing
+        # each by a random one with probability noise, until the game ends.
+        rand = random.Random(seed)
+        game = TetrisGame(seed)
+        reference = ReferenceTetris(seed)
+        autoplayer = Autoplayer()
+        plan = []
+        while not game.is_over() and game.get_state()['pieces'] < MAX_PIECES:
+            if not plan:
+                plan = autoplayer.get_actions(game)
+            action = plan.pop(0)
+            if rand.random() < noise:
+                action = rand.choice(sorted(Gactions))
+                plan = []
+            Gactions[action](game)
+            Gactions[action](reference)
+            self.check(game, reference, seed, action)
+
+    def check(self, game, reference, seed, action):
+        state, expected = game.get_state(), reference.get_state()
+        where = "seed {0}, piece {1}, after {2}".format(
+            seed, state['pieces'], action)
+        self.assertEqual(grid_to_cells(state['grid']), expected['grid'], where)
+        for key in ('pos', 'direction', 'moving', 'score', 'win', 'game_over'):
+            self.assertEqual(state[key], expected[key],
+                             "{0}: {1}".format(where, key))
+
+    def test_autoplayed(self):
+        for seed in range(GAMES):
+            self.play(seed, 0.0)
+
+    def test_few_mistakes(self):
+        # A few random moves stack the board up to the top while lines are
+        # still cleared, with cells locked in row 0 (first with seed 3).
+        for seed in range(GAMES):
+            self.play(seed, 0.05)
+
+    def test_random_actions(self):
+        for seed in range(GAMES):
+            self.play(seed, 0.3)
+
+if __name__ == '__main__':
+    unittest.main()